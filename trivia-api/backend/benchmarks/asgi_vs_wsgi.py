@@ -0,0 +1,143 @@
+"""Compare the sync (WSGI) and async (ASGI) trivia apps at high concurrency.
+
+Both servers are started against the same ``DATABASE_URL``, then driven
+with the same number of concurrent keep-alive connections for a fixed time.
+Run from the backend folder:
+
+    DATABASE_URL=postgresql://postgres@localhost:5432/trivia \\
+        python -m benchmarks.asgi_vs_wsgi --concurrency 200 --duration 20
+
+Requires gunicorn and uvicorn. Use the same worker count on both sides,
+since the comparison is per worker.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SERVERS = {
+    'wsgi': ['gunicorn', '--workers', '{workers}', '--bind', '127.0.0.1:{port}',
+             '--log-level', 'warning', 'flaskr:create_app()'],
+    'asgi': ['uvicorn', '--factory', 'flaskr.asgi:create_asgi_app', '--workers', '{workers}',
+             '--host', '127.0.0.1', '--port', '{port}', '--log-level', 'warning'],
+}
+DEFAULT_PATHS = ('/questions', '/questions?page=5', '/categories', '/categories/1/questions')
+
+
+async def fetch(reader, writer, path):
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: bench\r\n\r\n'.encode())
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError('server closed the connection')
+    length, keep_alive = 0, True
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'connection' and value == 'close':
+            keep_alive = False
+    await reader.readexactly(length)
+    return int(status_line.split()[1]), keep_alive
+
+
+async def worker(port, paths, deadline, latencies, errors):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    index = 0
+    try:
+        while time.monotonic() < deadline:
+            path = paths[index % len(paths)]
+            index += 1
+            started = time.perf_counter()
+            try:
+                status, keep_alive = await fetch(reader, writer, path)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                errors.append(path)
+                keep_alive = False
+            else:
+                latencies.append(time.perf_counter() - started)
+                if status >= 500:
+                    errors.append(path)
+            if not keep_alive:
+                # Sync gunicorn workers close after every response.
+                writer.close()
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    finally:
+        writer.close()
+
+
+async def load(port, paths, concurrency, duration):
+    latencies, errors = [], []
+    deadline = time.monotonic() + duration
+    await asyncio.gather(*(worker(port, paths, deadline, latencies, errors)
+                           for _ in range(concurrency)))
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'rps': round(len(latencies) / duration, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2) if latencies else None,
+    }
+
+
+async def wait_until_up(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            await fetch(reader, writer, '/')
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+def run(kind, args):
+    command = [part.format(workers=args.workers, port=args.port) for part in SERVERS[kind]]
+    server = subprocess.Popen(command, env=os.environ.copy())
+    try:
+        asyncio.run(wait_until_up(args.port))
+        asyncio.run(load(args.port, args.paths, args.concurrency, min(2, args.duration)))
+        return asyncio.run(load(args.port, args.paths, args.concurrency, args.duration))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--paths', nargs='+', default=list(DEFAULT_PATHS))
+    parser.add_argument('--only', choices=tuple(SERVERS))
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for kind in SERVERS:
+        if args.only and kind != args.only:
+            continue
+        results[kind] = run(kind, args)
+        result = results[kind]
+        print(f"{kind}: {result['rps']} req/s, p50 {result['p50_ms']} ms, "
+              f"p99 {result['p99_ms']} ms, {result['errors']} errors", file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'concurrency': args.concurrency, 'workers': args.workers,
+                       'results': results}, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
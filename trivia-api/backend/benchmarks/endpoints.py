@@ -0,0 +1,215 @@
+"""Time every trivia endpoint against a synthetic question bank.
+
+Builds (or reuses) a bank of ``--questions`` rows spread over categories
+with a Zipf-like skew, then times each scenario through the Flask test
+client and writes the results as JSON. With ``--baseline`` the run fails
+(exit status 1) when any scenario's median is slower than the baseline by
+more than ``--threshold``. Run from the backend folder:
+
+    python -m benchmarks.endpoints --questions 100000 --output run.json
+    python -m benchmarks.endpoints --questions 100000 --baseline run.json --threshold 0.25
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import func
+
+from flaskr import create_app, versions
+from flaskr.pagination import QUESTIONS_PER_PAGE, encode_cursor
+from models import db, rebuild_question_counts, Question, Category
+
+CATEGORY_NAMES = ('Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports',
+                  'Literature', 'Music', 'Politics', 'Nature', 'Technology', 'Food')
+VOCABULARY_SIZE = 5000
+INSERT_BATCH_SIZE = 10000
+
+
+def vocabulary(rng):
+    syllables = ['ka', 'lo', 'mi', 're', 'tu', 'sa', 'ne', 'vo', 'pi', 'da', 'go', 'shi']
+    return [''.join(rng.choices(syllables, k=rng.randint(2, 4))) + str(index)
+            for index in range(VOCABULARY_SIZE)]
+
+
+def category_weights(categories, skew):
+    return [1 / (rank ** skew) for rank in range(1, categories + 1)]
+
+
+def generate_bank(questions, categories=len(CATEGORY_NAMES), skew=1.2, seed=0):
+    """Insert ``questions`` synthetic rows in batches, keeping memory flat.
+
+    Words are drawn with a Zipf-like skew too, so ``vocabulary[0]`` is a
+    common search term and the last word is a rare one.
+    """
+    rng = random.Random(seed)
+    words = vocabulary(rng)
+    word_weights = category_weights(len(words), 1.0)
+    db.session.execute(Category.__table__.insert(),
+                       [{'type': CATEGORY_NAMES[index % len(CATEGORY_NAMES)]}
+                        for index in range(categories)])
+    db.session.commit()
+    category_ids = [row.id for row in db.session.query(Category.id).order_by(Category.id)]
+    weights = category_weights(len(category_ids), skew)
+
+    remaining = questions
+    while remaining:
+        size = min(INSERT_BATCH_SIZE, remaining)
+        remaining -= size
+        db.session.execute(Question.__table__.insert(), [{
+            'question': ' '.join(rng.choices(words, word_weights, k=rng.randint(5, 12))) + '?',
+            'answer': ' '.join(rng.choices(words, word_weights, k=rng.randint(1, 3))),
+            'category': rng.choices(category_ids, weights)[0],
+            'difficulty': rng.randint(1, 5)
+        } for _ in range(size)])
+        db.session.commit()
+    rebuild_question_counts()
+    versions.bump('questions', 'categories')
+    return words
+
+
+def scenarios(questions, words, quiz_history):
+    """Return ``{name: (method, path, json_body)}`` for the current bank."""
+    category_counts = dict(db.session.query(Question.category, func.count(Question.id))
+                           .group_by(Question.category))
+    largest = max(category_counts, key=category_counts.get)
+    smallest = min(category_counts, key=category_counts.get)
+    ids = [row.id for row in db.session.query(Question.id).order_by(Question.id)
+           .limit(quiz_history)]
+    deep_page = max(1, questions // QUESTIONS_PER_PAGE // 2)
+    middle_id = db.session.query(Question.id).order_by(Question.id) \
+        .offset(questions // 2).limit(1).scalar()
+
+    return {
+        'categories': ('GET', '/categories', None),
+        'stats': ('GET', '/stats', None),
+        'questions_first_page': ('GET', '/questions', None),
+        'questions_deep_page': ('GET', f'/questions?page={deep_page}', None),
+        'questions_deep_cursor': ('GET', f'/questions?cursor={encode_cursor(middle_id)}', None),
+        'category_largest': ('GET', f'/categories/{largest}/questions', None),
+        'category_smallest': ('GET', f'/categories/{smallest}/questions', None),
+        'search_common': ('POST', '/questions', {'searchTerm': words[0]}),
+        'search_rare': ('POST', '/questions', {'searchTerm': words[-1]}),
+        'quiz_fresh': ('POST', '/quizzes', {'previous_questions': [],
+                                            'quiz_category': {'id': 0, 'type': 'click'}}),
+        'quiz_long_history': ('POST', '/quizzes', {'previous_questions': ids,
+                                                   'quiz_category': {'id': 0, 'type': 'click'}}),
+        'quiz_session_start': ('POST', '/quizzes', {'quiz_session': None,
+                                                    'quiz_category': {'id': largest,
+                                                                      'type': 'x'}}),
+        'quiz_batch_of_10': ('POST', '/quizzes', {'previous_questions': [], 'count': 10,
+                                                  'quiz_category': {'id': 0, 'type': 'click'}}),
+    }
+
+
+def time_scenario(client, method, path, body, repeat, warmup):
+    timings = []
+    for run in range(warmup + repeat):
+        started = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise RuntimeError(f'{method} {path} returned {response.status_code}')
+        if run >= warmup:
+            timings.append(elapsed)
+    timings.sort()
+    return {
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'p95_ms': round(timings[max(0, int(len(timings) * 0.95) - 1)] * 1000, 3),
+        'runs': repeat
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return the scenarios whose median regressed by more than ``threshold``."""
+    regressions = {}
+    for name, result in results['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None or not previous['median_ms']:
+            continue
+        change = result['median_ms'] / previous['median_ms'] - 1
+        if change > threshold:
+            regressions[name] = round(change, 3)
+    return regressions
+
+
+def run(args):
+    database_url = args.database_url or 'sqlite:///' + os.path.join(
+        tempfile.gettempdir(), f'trivia_bench_{args.questions}.db')
+    app = create_app({'DATABASE_URL': database_url, 'RESPONSE_CACHE_URL': args.response_cache,
+                      'QUESTION_STORE': args.question_store, 'QUESTION_STORE_PRELOAD': False})
+    with app.app_context():
+        existing = db.session.query(func.count(Question.id)).scalar()
+        words = vocabulary(random.Random(args.seed))
+        if existing != args.questions:
+            if existing:
+                raise SystemExit(f'{database_url} holds {existing} questions, '
+                                 f'expected {args.questions}; use an empty database')
+            started = time.perf_counter()
+            words = generate_bank(args.questions, args.categories, args.skew, args.seed)
+            print(f'generated {args.questions} questions in '
+                  f'{time.perf_counter() - started:.1f}s', file=sys.stderr)
+        cases = scenarios(args.questions, words, args.quiz_history)
+        dialect = db.engine.dialect.name
+
+    client = app.test_client()
+    results = {
+        'meta': {'questions': args.questions, 'categories': args.categories,
+                 'skew': args.skew, 'database': dialect,
+                 'response_cache': args.response_cache or None,
+                 'question_store': args.question_store},
+        'results': {}
+    }
+    for name, (method, path, body) in cases.items():
+        if args.only and name not in args.only:
+            continue
+        results['results'][name] = time_scenario(client, method, path, body,
+                                                 args.repeat, args.warmup)
+        result = results['results'][name]
+        print(f"{name:<24} median {result['median_ms']:>9.3f} ms  "
+              f"p95 {result['p95_ms']:>9.3f} ms", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--questions', type=int, default=10000)
+    parser.add_argument('--categories', type=int, default=len(CATEGORY_NAMES))
+    parser.add_argument('--skew', type=float, default=1.2,
+                        help='Zipf exponent of the category distribution')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database-url', help='defaults to a SQLite file per bank size')
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--quiz-history', type=int, default=1000,
+                        help='length of previous_questions in quiz_long_history')
+    parser.add_argument('--response-cache', default='', metavar='URL',
+                        help='RESPONSE_CACHE_URL for the app; off by default so queries are timed')
+    parser.add_argument('--question-store', action='store_true',
+                        help='serve lists and quizzes from the in-memory question store')
+    parser.add_argument('--only', nargs='+', help='run only these scenarios')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against a previous JSON result')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed median slowdown before failing, 0.25 = 25%%')
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        for name, change in regressions.items():
+            print(f'REGRESSION {name}: median {change:+.0%}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Check that the planner uses the questions indexes for the app's queries.
+
+Each query is built by the same helpers the endpoints use and explained
+with the database's own EXPLAIN. The check fails when a plan does not name
+the index that was added for its shape. PostgreSQL prefers a sequential
+scan on small tables whatever the indexes, so sequential scans are turned
+off for the check unless ``--allow-seqscan`` is given. Run from the
+backend folder:
+
+    python -m benchmarks.query_plans --database-url sqlite:////tmp/trivia_bench_20000.db
+"""
+import argparse
+import json
+import sys
+
+from sqlalchemy import func, select, text
+
+from flaskr import create_app
+from flaskr.pagination import encode_cursor, page_query
+from flaskr.quiz import id_bounds_statement, rank_statement
+from models import database_path, db, Question, QuestionCount
+
+
+def plan_queries(category_id, difficulty, pivot):
+    """Return ``{name: (statement, expected_index)}`` for the indexed query shapes."""
+    category_page = select(*Question.columns()).filter(Question.category == category_id)
+    groups = (select(Question.category, Question.difficulty, func.count())
+              .group_by(Question.difficulty, Question.category))
+    return {
+        'category_page': (page_query(category_page, {'cursor': encode_cursor(pivot)}, Question.id),
+                          'ix_questions_category_id'),
+        'quiz_id_bounds': (id_bounds_statement(category_id), 'ix_questions_category_id'),
+        'quiz_rank': (rank_statement(category_id, 5), 'ix_questions_category_id'),
+        'quiz_rank_excluding': (rank_statement(category_id, 5, exclude=[pivot, pivot + 1]),
+                                'ix_questions_category_id'),
+        'batch_filter': (groups.where(Question.category == category_id,
+                                      Question.difficulty == difficulty),
+                         'ix_questions_difficulty_category_id'),
+        'batch_filter_difficulty': (groups.where(Question.difficulty == difficulty),
+                                    'ix_questions_difficulty_category_id'),
+        'recount': (groups, 'ix_questions_difficulty_category_id'),
+    }
+
+
+def _postgresql_indexes(node):
+    names = {node['Index Name']} if 'Index Name' in node else set()
+    for child in node.get('Plans', ()):
+        names |= _postgresql_indexes(child)
+    return names
+
+
+def explain(connection, statement):
+    """Return ``(index_names, plan_lines)`` for ``statement``."""
+    sql = str(statement.compile(dialect=connection.dialect,
+                                compile_kwargs={'literal_binds': True}))
+    if connection.dialect.name == 'postgresql':
+        plan = connection.execute(text(f'EXPLAIN (FORMAT JSON) {sql}')).scalar()[0]['Plan']
+        return _postgresql_indexes(plan), json.dumps(plan, indent=1).splitlines()
+    lines = [row[-1] for row in connection.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+    names = {word for line in lines for word in line.split() if word.startswith('ix_')}
+    return names, lines
+
+
+def check_plans(connection, allow_seqscan=False):
+    """Explain every query and report whether its index was used."""
+    if connection.dialect.name == 'postgresql' and not allow_seqscan:
+        connection.execute(text('SET LOCAL enable_seqscan = off'))
+    category_id, difficulty = connection.execute(
+        select(QuestionCount.category, QuestionCount.difficulty)
+        .order_by(QuestionCount.count.desc()).limit(1)).first() or (1, 1)
+    pivot = connection.execute(select(func.min(Question.id))).scalar() or 1
+
+    results = []
+    for name, (statement, expected) in plan_queries(category_id, difficulty, pivot).items():
+        used, lines = explain(connection, statement)
+        results.append({'query': name, 'expected': expected, 'used': sorted(used),
+                        'ok': expected in used, 'plan': lines})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=database_path)
+    parser.add_argument('--allow-seqscan', action='store_true',
+                        help='keep the PostgreSQL planner defaults')
+    parser.add_argument('--verbose', action='store_true', help='print every plan')
+    args = parser.parse_args()
+
+    app = create_app({'DATABASE_URL': args.database_url, 'DB_CREATE_SCHEMA': False})
+    with app.app_context():
+        try:
+            results = check_plans(db.session.connection(), args.allow_seqscan)
+        finally:
+            db.session.rollback()
+
+    for result in results:
+        status = 'ok  ' if result['ok'] else 'MISS'
+        print(f"{status} {result['query']:<24} expected {result['expected']}, "
+              f"used {', '.join(result['used']) or 'no index'}")
+        if args.verbose or not result['ok']:
+            for line in result['plan']:
+                print(f'       {line}')
+    sys.exit(0 if all(result['ok'] for result in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Compare JSON encoders and compression on a GET /questions style payload.
+
+Run from the backend folder:
+
+    python -m benchmarks.serialization --questions 1000 --output serialization.json
+"""
+import argparse
+import json
+import random
+import string
+import timeit
+
+from flaskr.serialization import SERIALIZERS, brotli, compress
+
+
+def build_payload(questions, categories=6, seed=0):
+    rng = random.Random(seed)
+
+    def words(count):
+        return ' '.join(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9)))
+                        for _ in range(count))
+
+    return {
+        'success': True,
+        'questions': [{
+            'id': question_id,
+            'question': words(rng.randint(6, 16)) + '?',
+            'answer': words(rng.randint(1, 3)),
+            'category': rng.randint(1, categories),
+            'difficulty': rng.randint(1, 5)
+        } for question_id in range(1, questions + 1)],
+        'total_questions': questions,
+        'categories': {category_id: words(1) for category_id in range(1, categories + 1)},
+        'current_category': None
+    }
+
+
+def best_of(function, repeat, number):
+    return min(timeit.repeat(function, repeat=repeat, number=number)) / number
+
+
+def run(questions, repeat=5, number=20):
+    payload = build_payload(questions)
+    results = {'questions': questions, 'encoders': {}, 'compression': {}}
+
+    body = None
+    for name, dumps in sorted(SERIALIZERS.items()):
+        body = dumps(payload)
+        results['encoders'][name] = {
+            'encode_us': round(best_of(lambda: dumps(payload), repeat, number) * 1e6, 1),
+            'bytes': len(body)
+        }
+
+    encodings = ['gzip'] + (['br'] if brotli is not None else [])
+    results['compression']['identity'] = {'bytes': len(body), 'encode_us': 0.0}
+    for encoding in encodings:
+        results['compression'][encoding] = {
+            'bytes': len(compress(body, encoding)),
+            'encode_us': round(best_of(lambda: compress(body, encoding), repeat, number) * 1e6, 1)
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--questions', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--number', type=int, default=20)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = run(args.questions, args.repeat, args.number)
+    print(f"{args.questions} questions")
+    for name, result in results['encoders'].items():
+        print(f"  encode {name:<8} {result['encode_us']:>10.1f} us {result['bytes']:>10} bytes")
+    for name, result in results['compression'].items():
+        print(f"  {name:<15} {result['encode_us']:>10.1f} us {result['bytes']:>10} bytes")
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Measure cold start and fork-to-first-request time of the Flask app.
+
+``cold`` runs each sample in a fresh interpreter and reports how long the
+imports, ``create_app()`` and the first request take. ``fork`` builds the
+app once, as ``gunicorn --preload`` does, then forks workers and times each
+one from the fork to its first response. Run from the backend folder:
+
+    DB_CREATE_SCHEMA=false python -m benchmarks.startup --samples 20 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+from flaskr import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+status = app.test_client().get(sys.argv[1]).status_code
+answered = time.perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000,
+                  "create_app_ms": (created - imported) * 1000,
+                  "first_request_ms": (answered - created) * 1000,
+                  "status": status}))
+'''
+
+
+def summarize(samples):
+    return {key: round(statistics.median(sample[key] for sample in samples), 3)
+            for key in samples[0] if key.endswith('_ms')}
+
+
+def cold(path, samples):
+    results = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', CHILD, path], check=True,
+                                capture_output=True, text=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        result['process_ms'] = (time.perf_counter() - started) * 1000
+        results.append(result)
+    return summarize(results)
+
+
+def fork(path, samples):
+    from flaskr import create_app
+    app = create_app()
+    results = []
+    for _ in range(samples):
+        read_end, write_end = os.pipe()
+        forked = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            status = app.test_client().get(path).status_code
+            os.write(write_end, json.dumps({
+                'fork_to_first_request_ms': (time.monotonic() - forked) * 1000,
+                'status': status
+            }).encode())
+            os._exit(0)
+        os.close(write_end)
+        with os.fdopen(read_end) as pipe:
+            results.append(json.loads(pipe.read()))
+        os.waitpid(pid, 0)
+    return summarize(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--samples', type=int, default=10)
+    parser.add_argument('--path', default='/questions', help='first request to time')
+    parser.add_argument('--only', choices=('cold', 'fork'))
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for mode, measure in (('cold', cold), ('fork', fork)):
+        if args.only and mode != args.only:
+            continue
+        results[mode] = measure(args.path, args.samples)
+        print(f'{mode}: ' + ', '.join(f'{key} {value} ms' for key, value in results[mode].items()),
+              file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'samples': args.samples, 'path': args.path,
+                       'create_schema': os.getenv('DB_CREATE_SCHEMA', 'true'),
+                       'results': results}, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Measure the memory held by the in-memory question store.
+
+Builds the synthetic bank of ``benchmarks.endpoints`` (or reuses it), then
+loads the store and reports its size per question and per million
+questions, next to the same rows held as a list of dicts. A forked child
+then serves requests from the inherited snapshot, and the script reports
+how much memory the child had to copy (Linux only). Run from the backend
+folder:
+
+    python -m benchmarks.store_memory --questions 1000000 --output store_memory.json
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy import func
+
+from flaskr import create_app
+from models import db, Question
+from .endpoints import generate_bank
+
+SMAPS = '/proc/self/smaps_rollup'
+
+
+def private_dirty_kb():
+    """Memory this process has written to and does not share, or ``None``."""
+    if not os.path.exists(SMAPS):
+        return None
+    with open(SMAPS) as smaps:
+        for line in smaps:
+            if line.startswith('Private_Dirty:'):
+                return int(line.split()[1])
+    return None
+
+
+def traced(build):
+    """Return ``(result, retained_bytes, peak_bytes)`` for ``build()``."""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, retained, peak
+
+
+def forked_copy_kb(app, requests):
+    """Serve ``requests`` in a forked child and return the memory it copied."""
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        client = app.test_client()
+        before = private_dirty_kb()
+        for method, path, body in requests:
+            client.open(path, method=method, json=body)
+        os.write(write_end, json.dumps(private_dirty_kb() - before).encode())
+        os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end) as pipe:
+        copied = json.loads(pipe.read())
+    os.waitpid(pid, 0)
+    return copied
+
+
+def run(args):
+    database_url = args.database_url or 'sqlite:///' + os.path.join(
+        tempfile.gettempdir(), f'trivia_bench_{args.questions}.db')
+    app = create_app({'DATABASE_URL': database_url, 'RESPONSE_CACHE_URL': '',
+                      'QUESTION_STORE': True, 'QUESTION_STORE_PRELOAD': False})
+    store = app.extensions['question_store']
+    with app.app_context():
+        existing = db.session.query(func.count(Question.id)).scalar()
+        if existing != args.questions:
+            if existing:
+                raise SystemExit(f'{database_url} holds {existing} questions, '
+                                 f'expected {args.questions}; use an empty database')
+            generate_bank(args.questions, seed=args.seed)
+
+        started = time.perf_counter()
+        snapshot = store.load()
+        load_seconds = time.perf_counter() - started
+        _, store_retained, store_peak = traced(lambda: store.load())
+        dicts, dicts_retained, _ = traced(
+            lambda: Question.format_rows(db.session.query(*Question.columns()).all()))
+        del dicts
+        db.session.remove()
+
+    questions = len(snapshot)
+    per_question = snapshot.nbytes / questions
+    results = {
+        'questions': questions,
+        'load_seconds': round(load_seconds, 3),
+        'store_bytes': snapshot.nbytes,
+        'store_bytes_per_question': round(per_question, 1),
+        'store_mb_per_million': round(per_question * 1_000_000 / 2 ** 20, 1),
+        'store_traced_bytes': store_retained,
+        'store_load_peak_bytes': store_peak,
+        'dicts_traced_bytes': dicts_retained,
+        'dicts_mb_per_million': round(dicts_retained / questions * 1_000_000 / 2 ** 20, 1),
+    }
+
+    if private_dirty_kb() is not None:
+        client = app.test_client()
+        requests = [('GET', '/questions', None)]
+        requests += [('GET', f'/questions?page={page}', None)
+                     for page in range(1, questions // 10, max(1, questions // 10 // 200))]
+        requests += [('POST', '/quizzes', {'previous_questions': [], 'count': 10,
+                                           'quiz_category': {'id': 0}})] * 200
+        # Warm the category cache in the parent, then drop its connections
+        # so the child never shares a socket with it.
+        client.get('/categories')
+        db.get_engine(app).dispose()
+        results['fork_requests'] = len(requests)
+        results['fork_copied_kb'] = forked_copy_kb(app, requests)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--questions', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database-url', help='defaults to a SQLite file per bank size')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = run(args)
+    for key, value in results.items():
+        print(f'{key:<28} {value}', file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
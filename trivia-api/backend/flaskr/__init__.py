@@ -1,67 +1,195 @@
 import os
-from flask import Flask, request, abort, jsonify
-from flask_sqlalchemy import SQLAlchemy
+import sys
+import click
+from flask import Flask, Response, request, abort, stream_with_context
 from flask_cors import CORS
-import random
 
-from models import setup_db, Question, Category
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
 
-QUESTIONS_PER_PAGE = 10
+from models import (DB_CREATE_SCHEMA, DB_REPLICA_LAG_WINDOW, database_path, db, pool_stats,
+                    rebuild_question_counts, setup_db, setup_schema, Question)
+from . import versions
+from .batch import delete_questions, parse_changes, parse_selection, patch_questions
+from .bulk import (EXPORT_FORMATS, EXPORT_RESOURCES, IMPORT_BATCH_SIZE, IMPORT_FORMATS,
+                   MAX_IMPORT_BATCH_SIZE, decode_lines, export_fields, export_rows,
+                   import_questions, iter_records, register_commands)
+from .cache import (RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_URL, cached,
+                    cached_response, init_cache)
+from .categories import CategoryCache
+from .conditional import conditional
+from .fields import parse_fields
+from .metrics import init_metrics
+from .pagination import paginate
+from .quiz import (QUIZ_SESSION_URL, create_session_store, is_session_id, parse_count,
+                   pick_random_questions, quiz_payload)
+from .replicas import init_replicas, read_only, use_replica
+from .search import TOKEN_RE, search_key, search_questions
+from .stats import question_stats, question_total
+from .store import QUESTION_STORE_MAX_AGE, init_store
+from .suggest import MAX_SUGGEST_LIMIT, SUGGEST_LIMIT, SUGGEST_MAX_AGE, SuggestIndex
+from .serialization import COMPRESS_MIN_SIZE, compress_response, init_serializer, jsonify
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              'migrations')
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    app.config['JSON_SERIALIZER'] = os.getenv('JSON_SERIALIZER')
+    app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', COMPRESS_MIN_SIZE))
+    app.config['RESPONSE_CACHE_URL'] = os.getenv('RESPONSE_CACHE_URL', RESPONSE_CACHE_URL)
+    app.config['RESPONSE_CACHE_TTL'] = float(os.getenv('RESPONSE_CACHE_TTL', RESPONSE_CACHE_TTL))
+    app.config['RESPONSE_CACHE_SIZE'] = int(os.getenv('RESPONSE_CACHE_SIZE', RESPONSE_CACHE_SIZE))
+    app.config['DATA_VERSION_MAX_AGE'] = float(os.getenv('DATA_VERSION_MAX_AGE',
+                                                         versions.DATA_VERSION_MAX_AGE))
+    app.config['SUGGEST_MAX_AGE'] = float(os.getenv('SUGGEST_MAX_AGE', SUGGEST_MAX_AGE))
+    app.config['QUIZ_SESSION_URL'] = os.getenv('QUIZ_SESSION_URL', QUIZ_SESSION_URL)
+    app.config['QUESTION_STORE'] = os.getenv('QUESTION_STORE', 'false').lower() in ('1', 'true', 'yes')
+    app.config['QUESTION_STORE_MAX_AGE'] = float(os.getenv('QUESTION_STORE_MAX_AGE',
+                                                           QUESTION_STORE_MAX_AGE))
+    app.config['QUESTION_STORE_PRELOAD'] = os.getenv('QUESTION_STORE_PRELOAD',
+                                                     'true').lower() in ('1', 'true', 'yes')
+    if test_config:
+        app.config.update(test_config)
+    init_serializer(app)
+    setup_db(app,
+             app.config.get('DATABASE_URL', database_path),
+             replica_paths=app.config.get('DATABASE_REPLICA_URLS'),
+             replica_lag_window=app.config.get('DB_REPLICA_LAG_WINDOW', DB_REPLICA_LAG_WINDOW),
+             create_schema=app.config.get('DB_CREATE_SCHEMA', DB_CREATE_SCHEMA))
+    init_metrics(app)
+    init_replicas(app)
+    init_cache(app)
+    question_store = init_store(app)
+    # Loaded on first use, so building the app (and forking workers from a
+    # preloaded master) opens no database connection.
+    category_cache = CategoryCache(app.config['DATA_VERSION_MAX_AGE'])
+    quiz_sessions = app.extensions['quiz_sessions'] = create_session_store(
+        app.config['QUIZ_SESSION_URL'])
+    suggest_index = app.extensions['suggest'] = SuggestIndex(app.config['SUGGEST_MAX_AGE'])
+    register_commands(app, category_cache)
+    # Flask-Migrate pulls in alembic, about 100 ms of imports that no worker
+    # needs. The flask CLI loads it before building the app for `flask db`.
+    if 'flask_migrate' in sys.modules:
+        from flask_migrate import Migrate
+        Migrate(app, db, directory=MIGRATIONS_DIR, render_as_batch=True)
+
+    @app.cli.command('init-db')
+    def init_db():
+        """Create missing tables and indexes from the models, without migrations."""
+        setup_schema()
+
+    @app.cli.command('rebuild-stats')
+    def rebuild_stats():
+        """Recount question_counts from the questions table."""
+        rebuild_question_counts()
+        click.echo(f"counted {question_total()} questions")
 
     # CORS
     CORS(app, resources={r"/api/*": {"origins": "*"}, r"/*": {"origins": "*"}})
 
-    def paginate_questions(request, selection):
-        page = request.args.get('page', 1, type=int)
-        start = (page - 1) * QUESTIONS_PER_PAGE
-        end = start + QUESTIONS_PER_PAGE
-        formatted_questions = [question.format() for question in selection]
-        return formatted_questions[start:end]
+    def paginate_questions(request, query):
+        selection, next_cursor = paginate(query, request.args, Question.id)
+        return Question.format_rows(selection), next_cursor
+
+    def requested_fields(allowed=Question.FIELDS):
+        try:
+            return parse_fields(request.args.get('fields'), allowed)
+        except ValueError:
+            abort(400)
 
     @app.route('/')
     def health():
         return jsonify({'success': True, 'message': 'Trivia API ready'}), 200
 
+    @app.route('/ready')
+    def ready():
+        pool = pool_stats(db.engine)
+        if not pool['saturated']:
+            try:
+                db.session.execute(text('SELECT 1'))
+                return jsonify({'success': True, 'pool': pool})
+            except SQLAlchemyError:
+                db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': 503,
+            'message': 'service unavailable',
+            'pool': pool
+        }), 503
+
     @app.after_request
     def after_request(response):
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,true')
-        response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
-        return response
+        response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,PATCH,DELETE,OPTIONS')
+        return compress_response(response)
 
     @app.route('/categories')
+    @conditional('categories')
+    @read_only
     def get_categories():
-        categories = Category.query.order_by(Category.id).all()
-        if not categories:
+        categories_dict = category_cache.all()
+        if not categories_dict:
             abort(404)
-        categories_dict = {category.id: category.type for category in categories}
         return jsonify({
             'success': True,
             'categories': categories_dict
         })
 
     @app.route('/questions')
+    @conditional('questions', 'categories')
+    @cached('questions', 'categories')
+    @read_only
     def get_questions():
-        selection = Question.query.order_by(Question.id).all()
-        current_questions = paginate_questions(request, selection)
+        fields = requested_fields()
+        if question_store is not None:
+            snapshot = question_store.snapshot()
+            current_questions, next_cursor = snapshot.page(request.args, fields=fields)
+            total = len(snapshot)
+        else:
+            current_questions, next_cursor = paginate_questions(request, Question.rows(fields))
+            total = None
         if len(current_questions) == 0:
             abort(404)
 
-        categories = Category.query.order_by(Category.id).all()
-        categories_dict = {category.id: category.type for category in categories}
-
         return jsonify({
             'success': True,
             'questions': current_questions,
-            'total_questions': len(selection),
-            'categories': categories_dict,
+            'total_questions': question_total() if total is None else total,
+            'next_cursor': next_cursor,
+            'categories': category_cache.all(),
             'current_category': None
         })
 
+    @app.route('/stats')
+    @conditional('questions', 'categories')
+    @cached('questions', 'categories')
+    @read_only
+    def get_stats():
+        return jsonify({
+            'success': True,
+            **question_stats(category_cache.all())
+        })
+
+    @app.route('/questions/suggest')
+    def suggest_questions():
+        query = request.args.get('q')
+        limit = request.args.get('limit', SUGGEST_LIMIT, type=int)
+        if query is None or not 1 <= limit <= MAX_SUGGEST_LIMIT:
+            abort(400)
+
+        # Complete the word being typed: the last one, unless the query
+        # already ends with a separator.
+        words = TOKEN_RE.findall(query.lower())
+        prefix = words[-1] if words and TOKEN_RE.fullmatch(query[-1]) else ''
+        suggestions = suggest_index.complete(prefix, limit) if prefix else []
+        return jsonify({
+            'success': True,
+            'prefix': prefix,
+            'suggestions': suggestions
+        })
+
     @app.route('/questions/<int:question_id>', methods=['DELETE'])
     def delete_question(question_id):
         question = Question.query.get(question_id)
@@ -84,14 +212,27 @@ def create_app(test_config=None):
 
         search_term = data.get('searchTerm')
         if search_term is not None:
-            selection = Question.query.filter(Question.question.ilike(f'%{search_term}%')).all()
-            current_questions = [q.format() for q in selection]
-            return jsonify({
-                'success': True,
-                'questions': current_questions,
-                'total_questions': len(selection),
-                'current_category': None
-            })
+            try:
+                page = int(data.get('page', 1))
+            except (TypeError, ValueError):
+                abort(400)
+            if not isinstance(search_term, str) or page < 1:
+                abort(400)
+            fields = requested_fields()
+            use_replica()
+
+            def search():
+                selection, total = search_questions(search_term, page, fields=fields)
+                return jsonify({
+                    'success': True,
+                    'questions': Question.format_rows(selection),
+                    'total_questions': total,
+                    'current_category': None
+                })
+
+            key = (f'search:{search_key(search_term, db.engine.dialect.name)}|{page}'
+                   f'|{",".join(fields)}')
+            return cached_response('search', key, ('questions',), search)
 
         question_text = data.get('question')
         answer_text = data.get('answer')
@@ -116,48 +257,146 @@ def create_app(test_config=None):
         except Exception:
             abort(422)
 
+    @app.route('/questions', methods=['DELETE'])
+    def batch_delete_questions():
+        data = request.get_json()
+        if not isinstance(data, dict):
+            abort(400)
+        try:
+            ids, filters = parse_selection(data)
+        except ValueError:
+            abort(400)
+
+        try:
+            outcome = delete_questions(ids, filters)
+        except SQLAlchemyError:
+            db.session.rollback()
+            abort(422)
+        return jsonify({'success': True, **outcome})
+
+    @app.route('/questions', methods=['PATCH'])
+    def batch_patch_questions():
+        data = request.get_json()
+        if not isinstance(data, dict):
+            abort(400)
+        try:
+            ids, filters = parse_selection(data)
+            changes = parse_changes(data.get('changes'), set(category_cache.all()))
+        except ValueError:
+            abort(400)
+
+        try:
+            outcome = patch_questions(changes, ids, filters)
+        except SQLAlchemyError:
+            db.session.rollback()
+            abort(422)
+        return jsonify({'success': True, **outcome})
+
+    @app.route('/questions/import', methods=['POST'])
+    def bulk_import_questions():
+        fmt = request.args.get('format')
+        if fmt is None:
+            fmt = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+        batch_size = request.args.get('batch_size', IMPORT_BATCH_SIZE, type=int)
+        if fmt not in IMPORT_FORMATS or not 1 <= batch_size <= MAX_IMPORT_BATCH_SIZE:
+            abort(400)
+
+        records = iter_records(decode_lines(request.stream), fmt)
+        summary = import_questions(records, set(category_cache.all()), batch_size)
+        return jsonify({
+            'success': True,
+            'received': summary['received'],
+            'inserted': summary['inserted'],
+            'failed': summary['failed'],
+            'errors': summary['errors']
+        })
+
+    @app.route('/export/<resource>')
+    @read_only
+    def export(resource):
+        if resource not in EXPORT_RESOURCES:
+            abort(404)
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in EXPORT_FORMATS:
+            abort(400)
+        fields = requested_fields(export_fields(resource))
+        return Response(stream_with_context(export_rows(resource, fmt, fields=fields)),
+                        mimetype=EXPORT_FORMATS[fmt])
+
     @app.route('/categories/<int:category_id>/questions')
+    @conditional('questions', 'categories')
+    @cached('questions', 'categories')
+    @read_only
     def get_questions_by_category(category_id):
-        category = Category.query.get(category_id)
-        if category is None:
+        category_type = category_cache.get(category_id)
+        if category_type is None:
+            abort(404)
+
+        fields = requested_fields()
+        if question_store is not None:
+            snapshot = question_store.snapshot()
+            current_questions, next_cursor = snapshot.page(request.args, category_id,
+                                                           fields=fields)
+            total = snapshot.count(category_id)
+        else:
+            query = Question.rows(fields).filter(Question.category == category_id)
+            current_questions, next_cursor = paginate_questions(request, query)
+            total = None
+        if len(current_questions) == 0 and request.args.get('page', 1, type=int) > 1:
             abort(404)
-        selection = Question.query.filter(Question.category == category_id).all()
-        current_questions = [q.format() for q in selection]
+
         return jsonify({
             'success': True,
             'questions': current_questions,
-            'total_questions': len(selection),
-            'current_category': category.type
+            'total_questions': question_total(category_id) if total is None else total,
+            'next_cursor': next_cursor,
+            'current_category': category_type
         })
 
     @app.route('/quizzes', methods=['POST'])
+    @read_only
     def play_quiz():
         data = request.get_json()
         if data is None:
             abort(400)
 
-        previous_questions = data.get('previous_questions', [])
         quiz_category = data.get('quiz_category')
         if quiz_category is None or 'id' not in quiz_category:
             abort(400)
 
-        category_id = int(quiz_category.get('id'))
+        try:
+            category_id = int(quiz_category.get('id'))
+            previous_questions = {int(qid) for qid in data.get('previous_questions') or []}
+            count = parse_count(data.get('count'))
+        except (TypeError, ValueError):
+            abort(400)
+        fields = requested_fields()
 
-        if category_id == 0:
-            questions_query = Question.query
+        if question_store is not None:
+            pick = question_store.snapshot().pick_random
         else:
-            questions_query = Question.query.filter(Question.category == category_id)
+            pick = pick_random_questions
 
-        remaining_questions = questions_query.filter(~Question.id.in_(previous_questions)).all()
+        if 'quiz_session' not in data:
+            questions = pick(category_id, previous_questions, count or 1, fields)
+            return jsonify(quiz_payload(questions, count))
 
-        next_question = None
-        if remaining_questions:
-            next_question = random.choice(remaining_questions).format()
+        session_id = data.get('quiz_session')
+        if session_id:
+            if not is_session_id(session_id):
+                abort(404)
+            session = quiz_sessions.get(session_id)
+            if session is None:
+                # Started by another worker, or expired: carry on from what
+                # the client says it has played.
+                session = quiz_sessions.start(category_id, previous_questions, session_id)
+        else:
+            session = quiz_sessions.start(category_id, previous_questions)
 
-        return jsonify({
-            'success': True,
-            'question': next_question
-        })
+        questions = pick(session.category_id, quiz_sessions.played(session) | previous_questions,
+                         count or 1, fields)
+        quiz_sessions.record(session, [question['id'] for question in questions])
+        return jsonify(quiz_payload(questions, count, quiz_session=session.id))
 
     @app.errorhandler(400)
     def bad_request(error):
@@ -0,0 +1,437 @@
+"""Async (ASGI) entry point serving the trivia routes.
+
+The routes, JSON bodies and error payloads match the Flask app in
+``flaskr/__init__.py``, but every query runs on an async SQLAlchemy session
+(asyncpg for PostgreSQL, aiosqlite for SQLite). A worker can then keep many
+requests in flight while it waits on the database. Run it with:
+
+    uvicorn --factory flaskr.asgi:create_asgi_app
+
+Bulk import and export stay on the WSGI app.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+from urllib.parse import parse_qsl
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+
+from models import Question, database_path
+from . import versions
+from .categories import CategoryCache, categories_statement
+from .fields import parse_fields
+from .pagination import count_statement, page_query, split_page
+from .stats import adjust, counts_statement, summarize, total_statement
+from .quiz import (QUIZ_SESSION_URL, RANK_ATTEMPTS, create_session_store, draw_pivots, draw_ranks,
+                   excluded_count_statement, format_row, id_bounds_statement, is_session_id,
+                   parse_count, probe_count, probe_statement, quiz_payload, rank_statement,
+                   take_hits)
+from .search import search_page_statement, search_statement
+from .serialization import get_serializer
+
+logger = logging.getLogger(__name__)
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgres': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+ERROR_MESSAGES = {
+    400: 'bad request',
+    404: 'resource not found',
+    405: 'method not allowed',
+    422: 'unprocessable',
+    500: 'internal server error',
+}
+
+RESPONSE_HEADERS = [
+    (b'access-control-allow-headers', b'Content-Type,Authorization,true'),
+    (b'access-control-allow-methods', b'GET,PUT,POST,DELETE,OPTIONS'),
+]
+
+
+def cors_headers(request):
+    """Allow any origin, echoing it back the way Flask-CORS does."""
+    origin = request.headers.get('origin')
+    if origin is None:
+        return [(b'access-control-allow-origin', b'*')] + RESPONSE_HEADERS
+    return [(b'access-control-allow-origin', origin.encode('latin-1')),
+            (b'vary', b'Origin')] + RESPONSE_HEADERS
+
+
+def async_database_url(url):
+    """Swap the sync driver of ``url`` for its asyncio counterpart."""
+    scheme, separator, rest = url.partition('://')
+    return f"{ASYNC_DRIVERS.get(scheme.split('+')[0], scheme)}{separator}{rest}"
+
+
+class HTTPError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+def abort(code):
+    raise HTTPError(code)
+
+
+def requested_fields(request):
+    try:
+        return parse_fields(request.args.get('fields'))
+    except ValueError:
+        abort(400)
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1'),
+                                        keep_blank_values=True))
+        self.headers = {key.decode('latin-1').lower(): value.decode('latin-1')
+                        for key, value in scope.get('headers', [])}
+        self.body = body
+
+    def get_json(self):
+        """Mirror Flask: ``None`` unless the body is JSON, 400 if malformed."""
+        if not self.headers.get('content-type', '').startswith('application/json'):
+            return None
+        try:
+            return json.loads(self.body or b'null')
+        except ValueError:
+            abort(400)
+
+
+class TriviaASGI:
+
+    def __init__(self, database_path=database_path, engine_options=None, quiz_session_url=None):
+        self.engine = create_async_engine(async_database_url(database_path),
+                                          **(engine_options or {}))
+        self.sessions = sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        self.dumps = get_serializer(os.getenv('JSON_SERIALIZER'))[1]
+        self.quiz_sessions = create_session_store(
+            quiz_session_url or os.getenv('QUIZ_SESSION_URL', QUIZ_SESSION_URL))
+        self.category_cache = CategoryCache(
+            int(os.getenv('DATA_VERSION_MAX_AGE', versions.DATA_VERSION_MAX_AGE)))
+        self.routes = [
+            ('GET', r'/', self.health),
+            ('GET', r'/categories', self.get_categories),
+            ('GET', r'/questions', self.get_questions),
+            ('GET', r'/stats', self.get_stats),
+            ('POST', r'/questions', self.create_or_search_question),
+            ('DELETE', r'/questions/(?P<question_id>\d+)', self.delete_question),
+            ('GET', r'/categories/(?P<category_id>\d+)/questions', self.get_questions_by_category),
+            ('POST', r'/quizzes', self.play_quiz),
+        ]
+        self.routes = [(method, re.compile(pattern + '$'), handler)
+                       for method, pattern, handler in self.routes]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        request = Request(scope, body)
+        methods = self.allowed_methods(request.path)
+        if request.method == 'OPTIONS' and methods:
+            # CORS preflight: an empty 200 listing the methods, as Flask answers it.
+            status, data = 200, b''
+            headers = [(b'allow', ', '.join(methods + ['OPTIONS']).encode('latin-1'))]
+        else:
+            status, payload = await self.dispatch(request)
+            data = self.dumps(payload)
+            headers = [(b'content-type', b'application/json')]
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': cors_headers(request) + headers + [
+                (b'content-length', str(len(data)).encode('latin-1')),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': data})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def allowed_methods(self, path):
+        return [method for method, pattern, _ in self.routes if pattern.match(path)]
+
+    async def dispatch(self, request):
+        allowed = False
+        for method, pattern, handler in self.routes:
+            match = pattern.match(request.path)
+            if match is None:
+                continue
+            if method != request.method:
+                allowed = True
+                continue
+            params = {key: int(value) for key, value in match.groupdict().items()}
+            try:
+                async with self.sessions() as session:
+                    return await handler(request, session, **params)
+            except (HTTPError, HTTPException) as error:
+                return self.error(error.code)
+            except Exception:
+                logger.exception('unhandled error on %s %s', request.method, request.path)
+                return self.error(500)
+        return self.error(405 if allowed else 404)
+
+    def error(self, code):
+        return code, {
+            'success': False,
+            'error': code,
+            'message': ERROR_MESSAGES.get(code, 'error')
+        }
+
+    async def categories(self, session):
+        # The same expiry as the Flask app's cache: this app never writes
+        # categories, so only the age bound picks up other processes' writes.
+        cache = self.category_cache
+        if cache.stale():
+            version = cache.freshness.start()
+            return cache.store((await session.execute(categories_statement())).all(), version)
+        return cache.peek()
+
+    async def adjust_counts(self, session, deltas):
+        # stats.adjust is synchronous; run_sync hands it this session's connection.
+        await session.run_sync(lambda sync_session: adjust(deltas, sync_session.connection()))
+
+    async def health(self, request, session):
+        return 200, {'success': True, 'message': 'Trivia API ready'}
+
+    async def get_categories(self, request, session):
+        categories = await self.categories(session)
+        if not categories:
+            abort(404)
+        return 200, {
+            'success': True,
+            'categories': categories
+        }
+
+    async def page(self, session, request, statement, category_id=None):
+        rows = (await session.execute(page_query(statement, request.args, Question.id))).all()
+        rows, next_cursor = split_page(rows)
+        total = (await session.execute(total_statement(category_id))).scalar()
+        return Question.format_rows(rows), next_cursor, total
+
+    async def get_questions(self, request, session):
+        current_questions, next_cursor, total = await self.page(
+            session, request, select(*Question.columns(requested_fields(request))))
+        if len(current_questions) == 0:
+            abort(404)
+
+        return 200, {
+            'success': True,
+            'questions': current_questions,
+            'total_questions': total,
+            'next_cursor': next_cursor,
+            'categories': await self.categories(session),
+            'current_category': None
+        }
+
+    async def get_stats(self, request, session):
+        rows = (await session.execute(counts_statement())).all()
+        return 200, {
+            'success': True,
+            **summarize(rows, await self.categories(session))
+        }
+
+    async def delete_question(self, request, session, question_id):
+        statement = delete(Question).where(Question.id == question_id)
+        key = (Question.category, Question.difficulty)
+        if self.engine.dialect.full_returning:
+            row = (await session.execute(statement.returning(*key))).first()
+        else:
+            row = (await session.execute(
+                select(*key).where(Question.id == question_id).with_for_update())).first()
+            if row is not None:
+                await session.execute(statement)
+        if row is None:
+            abort(404)
+        try:
+            await self.adjust_counts(session, {tuple(row): -1})
+            await session.commit()
+        except Exception:
+            abort(422)
+        versions.bump('questions')
+        return 200, {
+            'success': True,
+            'deleted': question_id
+        }
+
+    async def create_or_search_question(self, request, session):
+        data = request.get_json()
+        if data is None:
+            abort(400)
+
+        search_term = data.get('searchTerm')
+        if search_term is not None:
+            try:
+                page = int(data.get('page', 1))
+            except (TypeError, ValueError):
+                abort(400)
+            if not isinstance(search_term, str) or page < 1:
+                abort(400)
+            statement, ordering = search_statement(search_term, self.engine.dialect.name,
+                                                   requested_fields(request))
+            total = (await session.execute(count_statement(statement, Question.id))).scalar()
+            rows = (await session.execute(
+                search_page_statement(statement, ordering, page))).all()
+            return 200, {
+                'success': True,
+                'questions': Question.format_rows(rows),
+                'total_questions': total,
+                'current_category': None
+            }
+
+        question_text = data.get('question')
+        answer_text = data.get('answer')
+        category = data.get('category')
+        difficulty = data.get('difficulty')
+
+        if not question_text or not answer_text or category is None or difficulty is None:
+            abort(400)
+
+        try:
+            result = await session.execute(insert(Question).values(
+                question=question_text,
+                answer=answer_text,
+                category=int(category),
+                difficulty=int(difficulty)
+            ))
+            await self.adjust_counts(session, {(int(category), int(difficulty)): 1})
+            await session.commit()
+        except Exception:
+            abort(422)
+        versions.bump('questions')
+        return 201, {
+            'success': True,
+            'created': result.inserted_primary_key[0]
+        }
+
+    async def get_questions_by_category(self, request, session, category_id):
+        category_type = (await self.categories(session)).get(category_id)
+        if category_type is None:
+            abort(404)
+
+        statement = (select(*Question.columns(requested_fields(request)))
+                     .filter(Question.category == category_id))
+        current_questions, next_cursor, total = await self.page(
+            session, request, statement, category_id)
+        if len(current_questions) == 0 and request.args.get('page', 1, type=int) > 1:
+            abort(404)
+
+        return 200, {
+            'success': True,
+            'questions': current_questions,
+            'total_questions': total,
+            'next_cursor': next_cursor,
+            'current_category': category_type
+        }
+
+    async def pick_random_questions(self, session, category_id, exclude, count, fields):
+        lowest, highest = (await session.execute(id_bounds_statement(category_id))).one()
+        if lowest is None:
+            return []
+        exclude = set(exclude)
+        total = (await session.execute(total_statement(category_id or None))).scalar()
+        pivots = draw_pivots(lowest, highest,
+                             probe_count(count, lowest, highest, total - len(exclude)))
+        rows = (await session.execute(probe_statement(category_id, set(pivots), fields))).all()
+        questions = take_hits(pivots, rows, exclude, count)
+        exclude.update(question['id'] for question in questions)
+        if len(questions) < count and len(exclude) * 2 < total:
+            for _ in range((count - len(questions)) * RANK_ATTEMPTS):
+                row = (await session.execute(
+                    rank_statement(category_id, random.randrange(total), fields=fields))).first()
+                if row is not None and row.id not in exclude:
+                    exclude.add(row.id)
+                    questions.append(format_row(row))
+                    if len(questions) == count:
+                        break
+        if len(questions) < count:
+            excluded = 0
+            if exclude:
+                excluded = (await session.execute(
+                    excluded_count_statement(category_id, exclude))).scalar()
+            for rank in draw_ranks(total, excluded, count - len(questions)):
+                row = (await session.execute(
+                    rank_statement(category_id, rank, exclude, fields))).first()
+                if row is not None:
+                    questions.append(format_row(row))
+        return questions
+
+    async def session_call(self, method, *args):
+        """Call the quiz session store, in a thread when it waits on the network."""
+        if self.quiz_sessions.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    async def play_quiz(self, request, session):
+        data = request.get_json()
+        if data is None:
+            abort(400)
+
+        quiz_category = data.get('quiz_category')
+        if quiz_category is None or 'id' not in quiz_category:
+            abort(400)
+
+        try:
+            category_id = int(quiz_category.get('id'))
+            previous_questions = {int(qid) for qid in data.get('previous_questions') or []}
+            count = parse_count(data.get('count'))
+        except (TypeError, ValueError):
+            abort(400)
+        fields = requested_fields(request)
+
+        if 'quiz_session' not in data:
+            questions = await self.pick_random_questions(session, category_id,
+                                                         previous_questions, count or 1, fields)
+            return 200, quiz_payload(questions, count)
+
+        session_id = data.get('quiz_session')
+        if session_id:
+            if not is_session_id(session_id):
+                abort(404)
+            quiz_session = await self.session_call(self.quiz_sessions.get, session_id)
+            if quiz_session is None:
+                quiz_session = await self.session_call(self.quiz_sessions.start, category_id,
+                                                       previous_questions, session_id)
+        else:
+            quiz_session = await self.session_call(self.quiz_sessions.start, category_id,
+                                                   previous_questions)
+
+        questions = await self.pick_random_questions(
+            session, quiz_session.category_id,
+            self.quiz_sessions.played(quiz_session) | previous_questions, count or 1, fields)
+        await self.session_call(self.quiz_sessions.record, quiz_session,
+                                [question['id'] for question in questions])
+        return 200, quiz_payload(questions, count, quiz_session=quiz_session.id)
+
+
+def create_asgi_app(database_path=database_path, engine_options=None, quiz_session_url=None):
+    return TriviaASGI(database_path, engine_options, quiz_session_url)
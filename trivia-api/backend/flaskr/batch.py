@@ -0,0 +1,179 @@
+"""Set-based bulk delete and patch of questions.
+
+Questions are picked by an id list, by a filter on category and
+difficulty, or by both. Listed ids are handled in chunks of
+``ID_CHUNK_SIZE``, so each IN list stays under the driver's bound parameter
+limit, and each chunk is one DELETE or UPDATE statement. A filter alone is
+one statement over every matching row, whatever their number, and reports
+only how many rows it changed. The whole request commits once, so either
+every question is changed or none is. ORM mapper events do not see Core
+statements, so the ``questions`` version is bumped and the question counts
+are adjusted explicitly.
+"""
+from collections import Counter
+
+from sqlalchemy import delete, func, select, text, update
+
+from models import db, Question
+from . import stats, versions
+
+MAX_BATCH_IDS = 10000
+ID_CHUNK_SIZE = 500
+FILTER_FIELDS = ('category', 'difficulty')
+PATCHABLE_FIELDS = ('question', 'answer', 'category', 'difficulty')
+COUNTED_FIELDS = ('category', 'difficulty')
+
+
+def _integer(value, name):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f'{name} must be an integer')
+    return value
+
+
+def parse_selection(data):
+    """Return ``(ids, filters)`` from a request body, or raise ValueError.
+
+    ``ids`` keeps the order of the request with duplicates dropped. An empty
+    selection is rejected: it must never mean "every question".
+    """
+    ids, filters = data.get('ids'), data.get('filter')
+    if ids is None and filters is None:
+        raise ValueError('ids or filter is required')
+
+    if ids is not None:
+        if not isinstance(ids, list) or not ids:
+            raise ValueError('ids must be a non-empty list')
+        if len(ids) > MAX_BATCH_IDS:
+            raise ValueError(f'at most {MAX_BATCH_IDS} ids per request')
+        ids = list(dict.fromkeys(_integer(question_id, 'id') for question_id in ids))
+
+    if filters is not None:
+        if not isinstance(filters, dict) or not filters:
+            raise ValueError('filter must be a non-empty object')
+        unknown = set(filters) - set(FILTER_FIELDS)
+        if unknown:
+            raise ValueError(f"unknown filter fields: {', '.join(sorted(unknown))}")
+        filters = {field: _integer(value, field) for field, value in filters.items()}
+
+    return ids, filters
+
+
+def parse_changes(changes, category_ids):
+    """Validate the column values of a patch, or raise ValueError."""
+    if not isinstance(changes, dict) or not changes:
+        raise ValueError('changes must be a non-empty object')
+    unknown = set(changes) - set(PATCHABLE_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+    for field in ('question', 'answer'):
+        if field in changes and (not isinstance(changes[field], str) or not changes[field]):
+            raise ValueError(f'{field} must be a non-empty string')
+    for field in ('category', 'difficulty'):
+        if field in changes:
+            _integer(changes[field], field)
+    if 'category' in changes and changes['category'] not in category_ids:
+        raise ValueError(f"unknown category {changes['category']}")
+    return changes
+
+
+def _criteria(filters):
+    return [getattr(Question, field) == value for field, value in (filters or {}).items()]
+
+
+def _chunks(ids):
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        yield ids[start:start + ID_CHUNK_SIZE]
+
+
+def _apply_filter(statement, filters):
+    """Run ``statement`` once over every question matching ``filters``.
+
+    Returns ``{(category, difficulty): count}`` of the rows it touched, as
+    they were before it ran, read from one grouped count.
+    """
+    criteria = _criteria(filters)
+    if db.engine.dialect.name == 'postgresql':
+        # Hold off writers until the commit, so the rows counted are the
+        # rows the statement changes.
+        db.session.execute(text('LOCK TABLE questions IN SHARE ROW EXCLUSIVE MODE'))
+    groups = Counter({(category, difficulty): count for category, difficulty, count
+                      in db.session.execute(
+                          select(Question.category, Question.difficulty, func.count())
+                          .where(*criteria).group_by(Question.difficulty, Question.category))})
+    db.session.execute(statement.where(*criteria))
+    return groups
+
+
+def _apply(statement, ids, filters, lock_first=False):
+    """Run ``statement`` over the listed ``ids`` that match ``filters``.
+
+    Returns ``{id: (category, difficulty)}`` for the rows the statement
+    touched, as they were before it ran. RETURNING only reports old values
+    for a DELETE, so ``lock_first`` reads and locks the rows before an
+    UPDATE that changes them.
+    """
+    criteria = _criteria(filters)
+    columns = (Question.id, Question.category, Question.difficulty)
+    returning = db.engine.dialect.full_returning and not lock_first
+    touched = {}
+    for chunk in _chunks(ids):
+        chunk_statement = statement.where(Question.id.in_(chunk), *criteria)
+        if returning:
+            rows = db.session.execute(chunk_statement.returning(*columns)).all()
+        else:
+            rows = db.session.execute(select(*columns).where(
+                Question.id.in_(chunk), *criteria).with_for_update()).all()
+            db.session.execute(chunk_statement)
+        touched.update((question_id, (category, difficulty))
+                       for question_id, category, difficulty in rows)
+    return touched
+
+
+def _outcome(key, ids, touched):
+    """Commit, then report the touched and ``not_found`` ids in request order.
+
+    A filter-only selection (``ids`` is ``None``) reports only its total;
+    ``touched`` is then the grouped count of the rows it changed.
+    """
+    db.session.commit()
+    total = sum(touched.values()) if ids is None else len(touched)
+    if total:
+        versions.bump('questions')
+    if ids is None:
+        return {key: None, 'not_found': None, f'total_{key}': total}
+    return {
+        key: [question_id for question_id in ids if question_id in touched],
+        'not_found': [question_id for question_id in ids if question_id not in touched],
+        f'total_{key}': total,
+    }
+
+
+def _groups(statement, ids, filters, lock_first=False):
+    """Run ``statement`` and count the touched rows per (category, difficulty)."""
+    if ids is None:
+        touched = _apply_filter(statement, filters)
+        return touched, touched
+    touched = _apply(statement, ids, filters, lock_first)
+    return touched, Counter(touched.values())
+
+
+def delete_questions(ids=None, filters=None):
+    """Delete the selected questions in one transaction."""
+    touched, groups = _groups(delete(Question.__table__), ids, filters)
+    stats.adjust(Counter({key: -count for key, count in groups.items()}))
+    return _outcome('deleted', ids, touched)
+
+
+def patch_questions(changes, ids=None, filters=None):
+    """Apply the same ``changes`` to every selected question in one transaction."""
+    recount = any(field in changes for field in COUNTED_FIELDS)
+    touched, groups = _groups(update(Question.__table__).values(**changes), ids, filters,
+                              lock_first=recount)
+    if recount:
+        deltas = Counter()
+        for (category, difficulty), count in groups.items():
+            deltas[category, difficulty] -= count
+            deltas[changes.get('category', category),
+                   changes.get('difficulty', difficulty)] += count
+        stats.adjust(deltas)
+    return _outcome('updated', ids, touched)
@@ -0,0 +1,250 @@
+import csv
+import io
+import json
+import re
+from collections import Counter
+from itertools import islice
+
+import click
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Question, Category
+from . import stats, versions
+from .fields import parse_fields
+
+IMPORT_BATCH_SIZE = 1000
+MAX_IMPORT_BATCH_SIZE = 10000
+MAX_REPORTED_ERRORS = 100
+# Bounds of the INTEGER columns on PostgreSQL; SQLite stores larger values.
+INT32_MIN, INT32_MAX = -2 ** 31, 2 ** 31 - 1
+INTEGER_RE = re.compile(r'[+-]?[0-9]+')
+QUESTION_FIELDS = ('question', 'answer', 'category', 'difficulty')
+IMPORT_FORMATS = ('ndjson', 'csv')
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+EXPORT_RESOURCES = {
+    'questions': (Question.id, Question.question, Question.answer,
+                  Question.category, Question.difficulty),
+    'categories': (Category.id, Category.type),
+}
+
+
+def decode_lines(chunks, encoding='utf-8'):
+    """Decode byte lines (e.g. ``request.stream``) one at a time, lazily.
+
+    A line that is not valid ``encoding`` yields a ``ValueError`` in its
+    place, so it is reported as a failed row rather than stored with
+    replacement characters. A byte order mark before the first line is
+    dropped.
+    """
+    for number, chunk in enumerate(chunks):
+        try:
+            line = chunk.decode(encoding)
+        except UnicodeDecodeError:
+            yield ValueError(f'invalid {encoding}')
+            continue
+        yield line.removeprefix('\ufeff') if number == 0 else line
+
+
+def iter_records(lines, fmt):
+    """Yield ``(line_number, record)`` pairs from NDJSON or CSV text lines.
+
+    A line that cannot be decoded or parsed yields the ``ValueError`` in
+    place of the record so the caller can report it and carry on.
+    """
+    if fmt == 'csv':
+        undecoded = []
+
+        def text():
+            # The reader gets a blank line, which it skips, for each line
+            # that could not be decoded; line numbers stay aligned.
+            for number, line in enumerate(lines, 1):
+                if isinstance(line, ValueError):
+                    undecoded.append((number, line))
+                    yield '\n'
+                else:
+                    yield line
+
+        reader = csv.DictReader(text())
+        for record in reader:
+            while undecoded and undecoded[0][0] < reader.line_num:
+                yield undecoded.pop(0)
+            yield reader.line_num, record
+        yield from undecoded
+        return
+
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, ValueError):
+            yield number, line
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, ValueError('invalid JSON')
+
+
+def _integer(value, name):
+    """Accept an int, or a string of digits as CSV gives it; never a bool or float."""
+    if isinstance(value, str) and INTEGER_RE.fullmatch(value.strip()):
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f'{name} must be an integer')
+    if not INT32_MIN <= value <= INT32_MAX:
+        raise ValueError(f'{name} out of range')
+    return value
+
+
+def validate_record(record, category_ids):
+    """Return the insert parameters for one record or raise ValueError."""
+    if isinstance(record, ValueError):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError('expected an object')
+
+    missing = [field for field in QUESTION_FIELDS if record.get(field) in (None, '')]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+    question, answer = record['question'], record['answer']
+    if not isinstance(question, str) or not isinstance(answer, str):
+        raise ValueError('question and answer must be strings')
+    category = _integer(record['category'], 'category')
+    difficulty = _integer(record['difficulty'], 'difficulty')
+    if category not in category_ids:
+        raise ValueError(f'unknown category {category}')
+
+    return {
+        'question': question,
+        'answer': answer,
+        'category': category,
+        'difficulty': difficulty
+    }
+
+
+def import_questions(records, category_ids, batch_size=IMPORT_BATCH_SIZE):
+    """Validate and insert ``(line_number, record)`` pairs in batches.
+
+    Each batch is written with a single multi-row INSERT (executemany) and
+    committed on its own, so a bad batch never rolls back earlier ones and
+    only ``batch_size`` rows are held in memory at a time. Invalid rows are
+    skipped and reported by line number; at most ``MAX_REPORTED_ERRORS`` of
+    them are listed, the rest are only counted. A batch the database
+    rejects is split in halves and retried, down to single rows, so only
+    the rows that fail on their own are reported and the rest are inserted.
+    """
+    summary = {'received': 0, 'inserted': 0, 'failed': 0, 'errors': []}
+
+    def fail(line, message):
+        summary['failed'] += 1
+        if len(summary['errors']) < MAX_REPORTED_ERRORS:
+            summary['errors'].append({'line': line, 'error': message})
+
+    def insert(rows, lines):
+        try:
+            db.session.execute(Question.__table__.insert(), rows)
+            stats.adjust(Counter((row['category'], row['difficulty']) for row in rows))
+            db.session.commit()
+        except SQLAlchemyError as error:
+            db.session.rollback()
+            if len(rows) == 1:
+                fail(lines[0], str(getattr(error, 'orig', None) or error))
+                return
+            middle = len(rows) // 2
+            insert(rows[:middle], lines[:middle])
+            insert(rows[middle:], lines[middle:])
+            return
+        versions.bump('questions')
+        summary['inserted'] += len(rows)
+
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        summary['received'] += len(batch)
+
+        rows, lines = [], []
+        for line, record in batch:
+            try:
+                rows.append(validate_record(record, category_ids))
+                lines.append(line)
+            except ValueError as error:
+                fail(line, str(error))
+        if rows:
+            insert(rows, lines)
+
+    return summary
+
+
+def export_fields(resource):
+    return tuple(column.key for column in EXPORT_RESOURCES[resource])
+
+
+def export_rows(resource, fmt, batch_size=EXPORT_BATCH_SIZE, fields=None):
+    """Yield a table as NDJSON or CSV text, one chunk per ``batch_size`` rows.
+
+    ``fields`` narrows the export to those columns, in table order.
+
+    Rows are read through a server-side cursor with ``yield_per`` and never
+    turned into ORM objects, so memory stays constant however large the
+    table is and the first chunk goes out as soon as the first batch is read.
+    """
+    columns = EXPORT_RESOURCES[resource]
+    key = columns[0]
+    if fields is not None:
+        columns = [column for column in columns if column.key in fields]
+    keys = [column.key for column in columns]
+    query = db.session.query(*columns).order_by(key).yield_per(batch_size)
+    results = iter(query)
+    batches = iter(lambda: list(islice(results, batch_size)), [])
+
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(keys)
+        yield buffer.getvalue()
+        for batch in batches:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(batch)
+            yield buffer.getvalue()
+        return
+
+    for batch in batches:
+        yield ''.join(json.dumps(dict(zip(keys, row))) + '\n' for row in batch)
+
+
+def register_commands(app, category_cache):
+    @app.cli.command('import-questions')
+    @click.argument('source', type=click.File('rb'))
+    @click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS),
+                  default=None, help='Defaults to the file extension.')
+    @click.option('--batch-size', type=click.IntRange(1, MAX_IMPORT_BATCH_SIZE),
+                  default=IMPORT_BATCH_SIZE, show_default=True)
+    def import_questions_command(source, fmt, batch_size):
+        """Bulk load questions from an NDJSON or CSV file ('-' for stdin)."""
+        if fmt is None:
+            fmt = 'csv' if source.name.endswith('.csv') else 'ndjson'
+        records = iter_records(decode_lines(source), fmt)
+        summary = import_questions(records, set(category_cache.all()), batch_size)
+        click.echo(f"inserted {summary['inserted']} of {summary['received']} rows, "
+                   f"{summary['failed']} failed")
+        for error in summary['errors']:
+            click.echo(f"line {error['line']}: {error['error']}", err=True)
+
+    @app.cli.command('export')
+    @click.argument('resource', type=click.Choice(tuple(EXPORT_RESOURCES)))
+    @click.option('--format', 'fmt', type=click.Choice(tuple(EXPORT_FORMATS)),
+                  default='ndjson', show_default=True)
+    @click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-')
+    @click.option('--fields', help='Comma-separated columns to export; id is always included.')
+    def export_command(resource, fmt, output, fields):
+        """Stream questions or categories to a file (stdout by default)."""
+        try:
+            fields = parse_fields(fields, export_fields(resource))
+        except ValueError as error:
+            raise click.BadParameter(str(error), param_hint='--fields')
+        for chunk in export_rows(resource, fmt, fields=fields):
+            output.write(chunk)
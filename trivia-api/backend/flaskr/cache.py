@@ -0,0 +1,288 @@
+"""Response cache for the read-only trivia endpoints.
+
+A cached body is stored under the route, the normalized request (sorted
+query string, or the search term and page), and the current version of
+every tag (table) the view reads. Any committed write bumps the tags it
+touched, so older entries are never looked up again and age out through
+the LRU bound or the TTL. The default backend is an in-process LRU. Setting
+``RESPONSE_CACHE_URL`` to a ``redis://`` URL shares entries and tag versions
+between workers through any server that speaks the Redis protocol.
+"""
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+from flask import Response, current_app, g, has_app_context, make_response, request
+
+from models import db
+from . import versions
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_URL = 'memory://'
+RESPONSE_CACHE_TTL = 60
+RESPONSE_CACHE_SIZE = 1024
+KEY_PREFIX = 'trivia:cache:'
+
+NEVER = float('-inf')
+# Errors a backend call may raise that must not fail the request; each
+# backend adds its client's own in ``errors``.
+BACKEND_ERRORS = (OSError,)
+
+
+class MemoryBackend:
+    """LRU of ``max_entries`` bodies, each dropped ``ttl`` seconds after it was stored."""
+
+    shared = False
+    errors = BACKEND_ERRORS
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def tags(self, names):
+        """Return ``(version, bumped_at)`` for each tag in ``names``."""
+        with self._lock:
+            return tuple(self._tags.get(name, (0, NEVER)) for name in names)
+
+    def bump(self, names):
+        now = time.time()
+        with self._lock:
+            for name in names:
+                self._tags[name] = (self._tags.get(name, (0, NEVER))[0] + 1, now)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, body = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return body
+
+    def set(self, key, body, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+class RedisBackend:
+    """Entries and tag versions kept in a Redis-protocol server.
+
+    Tag versions are ``INCR`` counters with a wall-clock timestamp next to
+    them, so every worker sees every other worker's writes. The redis
+    package is only imported when such a backend is configured.
+    """
+
+    shared = True
+
+    def __init__(self, client, errors=BACKEND_ERRORS):
+        self.client = client
+        self.errors = errors
+
+    @classmethod
+    def from_url(cls, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RESPONSE_CACHE_URL needs the redis package')
+        return cls(redis.Redis.from_url(url), BACKEND_ERRORS + (redis.RedisError,))
+
+    def tags(self, names):
+        keys = []
+        for name in names:
+            keys += [f'{KEY_PREFIX}tag:{name}', f'{KEY_PREFIX}tag:{name}:at']
+        values = self.client.mget(keys)
+        return tuple((int(values[index] or 0),
+                      float(values[index + 1]) if values[index + 1] else NEVER)
+                     for index in range(0, len(values), 2))
+
+    def bump(self, names):
+        pipeline = self.client.pipeline()
+        for name in names:
+            pipeline.incr(f'{KEY_PREFIX}tag:{name}')
+            pipeline.set(f'{KEY_PREFIX}tag:{name}:at', repr(time.time()))
+        pipeline.execute()
+
+    def get(self, key):
+        return self.client.get(KEY_PREFIX + key)
+
+    def set(self, key, body, ttl):
+        self.client.set(KEY_PREFIX + key, body, ex=max(1, round(ttl)))
+
+
+
+def create_backend(url, max_entries=RESPONSE_CACHE_SIZE):
+    if url.startswith('memory:'):
+        return MemoryBackend(max_entries)
+    if url.startswith(('redis:', 'rediss:', 'unix:')):
+        return RedisBackend.from_url(url)
+    raise ValueError(f'unsupported RESPONSE_CACHE_URL {url!r}')
+
+
+class ResponseCache:
+
+    def __init__(self, backend, ttl=RESPONSE_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._stats = {}
+        self._lock = Lock()
+        versions.on_bump(self.invalidate)
+
+    def invalidate(self, tags):
+        try:
+            self.backend.bump(tags)
+        except self.backend.errors:
+            # Entries still expire after the TTL; a failed bump must not
+            # fail the write that has already committed.
+            logger.exception('response cache invalidation failed for %s', tags)
+
+    def _record(self, route, outcome):
+        with self._lock:
+            counts = self._stats.setdefault(route, {'hits': 0, 'misses': 0, 'errors': 0})
+            counts[outcome] += 1
+
+    def respond(self, route, key, tags, view):
+        """Serve ``key`` from the cache, or call ``view()`` and store a 200 reply."""
+        try:
+            tag_state = self.backend.tags(tags)
+            version = '.'.join(str(tag_version) for tag_version, _ in tag_state)
+            digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+            cache_key = f'{version}:{digest}'
+            body = self.backend.get(cache_key)
+        except self.backend.errors:
+            logger.exception('response cache lookup failed')
+            self._record(route, 'errors')
+            return view()
+
+        if body is not None:
+            self._record(route, 'hits')
+            return Response(body, mimetype='application/json')
+
+        self._record(route, 'misses')
+        response = make_response(view())
+        if (response.status_code == 200 and not response.is_streamed
+                and not read_is_stale(tag_state)):
+            try:
+                self.backend.set(cache_key, response.get_data(), self.ttl)
+            except self.backend.errors:
+                logger.exception('response cache store failed')
+        return response
+
+    def stats(self):
+        with self._lock:
+            stats = {route: dict(counts) for route, counts in self._stats.items()}
+        return stats
+
+    def render(self):
+        """Hit, miss and error counters in Prometheus text format."""
+        lines = ['# HELP trivia_response_cache_requests_total Response cache lookups by route and outcome.',
+                 '# TYPE trivia_response_cache_requests_total counter']
+        for route, counts in sorted(self.stats().items()):
+            for outcome, value in counts.items():
+                lines.append(f'trivia_response_cache_requests_total'
+                             f'{{route="{route}",outcome="{outcome}"}} {value}')
+        if isinstance(self.backend, MemoryBackend):
+            lines += ['# HELP trivia_response_cache_entries Entries held by the in-process cache.',
+                      '# TYPE trivia_response_cache_entries gauge',
+                      f'trivia_response_cache_entries {len(self.backend)}',
+                      '# HELP trivia_response_cache_evictions_total Entries evicted by the LRU bound.',
+                      '# TYPE trivia_response_cache_evictions_total counter',
+                      f'trivia_response_cache_evictions_total {self.backend.evictions}']
+        return lines
+
+
+def shared_tag_state(tags):
+    """``(version, bumped_at)`` of each tag as every worker sees it, or ``None``.
+
+    ``None`` means there is no shared backend, or it could not be reached,
+    and the caller has to rely on this process's own counters.
+    """
+    cache = current_app.extensions.get('response_cache')
+    if cache is None or not cache.backend.shared:
+        return None
+    try:
+        return cache.backend.tags(tags)
+    except cache.backend.errors:
+        logger.exception('shared tag versions lookup failed')
+        return None
+
+
+def mark_stale_read():
+    """Flag the current response as built from data older than its versions.
+
+    An in-process copy that is still being rebuilt after a write calls
+    this. ``read_is_stale`` then keeps the response out of the cache and
+    out of ETags, since both would file it under the post-write versions.
+    """
+    if has_app_context():
+        g.stale_read = True
+
+
+def read_is_stale(tag_state=()):
+    """Whether the response may predate the ``(version, bumped_at)`` tags.
+
+    That is the case after ``mark_stale_read``, or when the request read a
+    replica that may not have replayed the newest tag bump yet: another
+    worker may have bumped a tag moments ago.
+    """
+    if g.get('stale_read'):
+        return True
+    router = current_app.extensions.get('replicas')
+    if not router or db.session.info.get('replica') is None:
+        return False
+    last_bump = max((bumped_at for _, bumped_at in tag_state), default=NEVER)
+    return time.time() - last_bump < router.lag_window
+
+
+def request_key():
+    """The request path plus its query arguments in a canonical order."""
+    args = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items(multi=True)))
+    return f'{request.path}?{args}'
+
+
+def cached_response(route, key, tags, view):
+    """Run ``view()`` through the app's response cache, if one is enabled."""
+    cache = current_app.extensions.get('response_cache')
+    if cache is None:
+        return view()
+    return cache.respond(route, key, tags, view)
+
+
+def cached(*tags):
+    """Cache a GET view's 200 responses until a write bumps one of ``tags``."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            return cached_response(request.url_rule.rule, request_key(), tags,
+                                   lambda: view(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def init_cache(app):
+    """Build the cache from ``RESPONSE_CACHE_*`` settings; an empty URL disables it."""
+    url = app.config.get('RESPONSE_CACHE_URL')
+    if not url:
+        app.extensions['response_cache'] = None
+        return None
+    backend = create_backend(url, app.config.get('RESPONSE_CACHE_SIZE', RESPONSE_CACHE_SIZE))
+    cache = app.extensions['response_cache'] = ResponseCache(
+        backend, app.config.get('RESPONSE_CACHE_TTL', RESPONSE_CACHE_TTL))
+    app.extensions['metrics'].add_collector(cache.render)
+    return cache
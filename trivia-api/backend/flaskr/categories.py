@@ -0,0 +1,61 @@
+from threading import Lock
+
+from sqlalchemy import select
+
+from models import db, Category
+from . import versions
+
+
+def categories_statement():
+    return select(Category.id, Category.type).order_by(Category.id)
+
+
+class CategoryCache:
+    """In-process copy of the ``categories`` table.
+
+    The table is tiny and rarely written, so it is read once and then served
+    from memory until a write bumps the ``categories`` data version, or
+    until it is ``max_age`` seconds old, which picks up other workers' writes.
+    """
+
+    def __init__(self, max_age=versions.DATA_VERSION_MAX_AGE):
+        self.freshness = versions.Freshness('categories', max_age)
+        self._categories = {}
+        self._lock = Lock()
+
+    @property
+    def version(self):
+        return self.freshness.version
+
+    def stale(self):
+        return self.freshness.stale()
+
+    def store(self, rows, version):
+        """Keep ``(id, type)`` rows read at ``version`` and return them as a dict."""
+        categories = {category_id: category_type for category_id, category_type in rows}
+        with self._lock:
+            self._categories = categories
+            self.freshness.mark(version)
+        return categories
+
+    def peek(self):
+        """Return the categories as last stored, without checking they are current."""
+        return self._categories
+
+    def load(self):
+        version = self.freshness.start()
+        return self.store(db.session.execute(categories_statement()), version)
+
+    def all(self):
+        """Return ``{id: type}`` for every category. Do not mutate it."""
+        if self.stale():
+            return self.load()
+        return self._categories
+
+    def get(self, category_id):
+        """Return the type of one category, or ``None`` if it does not exist."""
+        return self.all().get(category_id)
+
+    def invalidate(self):
+        with self._lock:
+            self.freshness.reset()
@@ -0,0 +1,63 @@
+import hashlib
+import uuid
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+from . import versions
+from .cache import read_is_stale, shared_tag_state
+from .serialization import ENCODINGS
+
+# Data versions are per process, so tag every ETag with this worker's boot id:
+# a tag minted by another worker never matches and just costs a full reply.
+BOOT_ID = uuid.uuid4().hex[:8]
+
+
+def make_etag(tables):
+    """Build a strong ETag from the data versions and the request URL.
+
+    With a Redis response cache the versions are its shared tag counters,
+    which a write on any worker bumps, so the tag is valid on every worker.
+    Otherwise they are this worker's counters plus the current
+    ``DATA_VERSION_MAX_AGE`` period, so a write served by another worker
+    ends the 304s within that period. Returns the tag and the shared
+    ``(version, bumped_at)`` state it was built from (empty when local).
+    """
+    args = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items(multi=True)))
+    digest = hashlib.blake2b(f'{request.path}?{args}'.encode('utf-8'), digest_size=8)
+    tag_state = shared_tag_state(tables)
+    if tag_state is None:
+        origin, tag_state = BOOT_ID, ()
+        max_age = current_app.config.get('DATA_VERSION_MAX_AGE', versions.DATA_VERSION_MAX_AGE)
+        numbers = versions.snapshot(*tables) + (versions.epoch(max_age),)
+    else:
+        origin = 'shared'
+        numbers = [tag_version for tag_version, _ in tag_state]
+    version = '.'.join(str(number) for number in numbers)
+    return f'{origin}-{version}-{digest.hexdigest()}', tag_state
+
+
+def conditional(*tables):
+    """Answer ``If-None-Match`` for a GET view that only reads ``tables``.
+
+    The ETag is computed before the view runs, so a matching request gets a
+    304 without touching the database or the serializer. A reply the view
+    built from stale data (see ``read_is_stale``) goes out without one.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag, tag_state = make_etag(tables)
+            # Compressed replies carry the encoding as an ETag suffix.
+            for variant in [etag] + [f'{etag}-{encoding}' for encoding in ENCODINGS]:
+                if request.if_none_match.contains(variant):
+                    response = make_response('', 304)
+                    response.set_etag(variant)
+                    return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not read_is_stale(tag_state):
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
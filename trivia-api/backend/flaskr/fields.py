@@ -0,0 +1,23 @@
+"""Sparse fieldsets: ``?fields=id,question`` on the routes that return questions.
+
+The chosen fields narrow the SQL projection as well as the JSON reply, so a
+client that only shows the question text never reads or receives answers.
+"""
+from models import Question
+
+
+def parse_fields(value, allowed=Question.FIELDS):
+    """Return the fields named in the comma-separated ``value``, in ``allowed`` order.
+
+    ``None`` means every field. ``id`` is always included, because cursors,
+    quiz exclusions and quiz sessions are keyed on it. Raises ``ValueError``
+    for an unknown name or an empty list.
+    """
+    if value is None:
+        return tuple(allowed)
+    names = {name.strip() for name in value.split(',')} - {''}
+    unknown = names - set(allowed)
+    if not names or unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(unknown)) or value!r}")
+    names.add('id')
+    return tuple(field for field in allowed if field in names)
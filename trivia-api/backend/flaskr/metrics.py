@@ -0,0 +1,132 @@
+"""Request latency, SQL and payload metrics in Prometheus text format.
+
+Each request records its duration, status, response size and the number
+and time of SQL statements it ran (counted by SQLAlchemy engine events).
+All figures are kept per route template, so ``/questions/<int:question_id>``
+is one series, not one per id. Updates are a bisect plus a few integer
+additions under a lock, cheap enough to leave on in production.
+"""
+import time
+from bisect import bisect_left
+from threading import Lock
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (128, 1024, 8192, 65536, 524288, 4194304, 33554432)
+
+
+class Histogram:
+    def __init__(self, name, description, buckets, labels):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.labels = labels
+        self.series = {}
+
+    def observe(self, label_values, value):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += 1
+        series[2] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for label_values, (counts, total, value_sum) in sorted(self.series.items()):
+            labels = ','.join(f'{key}="{value}"' for key, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {total}')
+            lines.append(f'{self.name}_sum{{{labels}}} {value_sum}')
+            lines.append(f'{self.name}_count{{{labels}}} {total}')
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = Lock()
+        self.collectors = []
+        self.latency = Histogram('trivia_request_duration_seconds',
+                                 'Request latency by route, method and status.',
+                                 LATENCY_BUCKETS, ('route', 'method', 'status'))
+        self.statements = Histogram('trivia_request_sql_statements',
+                                    'SQL statements executed per request.',
+                                    STATEMENT_BUCKETS, ('route',))
+        self.sql_time = Histogram('trivia_request_sql_duration_seconds',
+                                  'Time spent in SQL per request.',
+                                  LATENCY_BUCKETS, ('route',))
+        self.size = Histogram('trivia_response_size_bytes',
+                              'Response body size by route (streamed bodies excluded).',
+                              SIZE_BUCKETS, ('route',))
+
+    def record(self, route, method, status, duration, statements, sql_time, size):
+        with self._lock:
+            self.latency.observe((route, method, str(status)), duration)
+            self.statements.observe((route,), statements)
+            self.sql_time.observe((route,), sql_time)
+            if size is not None:
+                self.size.observe((route,), size)
+
+    def add_collector(self, collector):
+        """Append the lines returned by ``collector()`` to every scrape."""
+        self.collectors.append(collector)
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for histogram in (self.latency, self.statements, self.sql_time, self.size):
+                lines.extend(histogram.render())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _end_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_statements' in g:
+        g.sql_statements += 1
+        g.sql_time += time.perf_counter() - conn.info.get('query_started', time.perf_counter())
+
+
+def init_metrics(app):
+    """Record every request and serve the figures at ``/metrics``.
+
+    Call this before registering other ``after_request`` hooks: Flask runs
+    them in reverse order, so the size recorded is the final, compressed one.
+    """
+    metrics = app.extensions['metrics'] = Metrics()
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_time = 0.0
+
+    @app.after_request
+    def record_request(response):
+        if 'request_started' not in g:
+            return response
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        size = None if response.is_streamed else response.content_length
+        metrics.record(route, request.method, response.status_code,
+                       time.perf_counter() - g.request_started,
+                       g.sql_statements, g.sql_time, size)
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    return metrics
@@ -0,0 +1,74 @@
+import base64
+import json
+
+from flask import abort
+from sqlalchemy import func
+
+QUESTIONS_PER_PAGE = 10
+
+
+def encode_cursor(last_id):
+    """Build the opaque token a client sends back to fetch the next page."""
+    raw = json.dumps({'after': last_id}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Return the id encoded in a cursor token, or raise ValueError."""
+    padded = token + '=' * (-len(token) % 4)
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        after = payload['after']
+    except (ValueError, TypeError, KeyError):
+        raise ValueError(f'invalid cursor: {token!r}')
+    if not isinstance(after, int) or isinstance(after, bool):
+        raise ValueError(f'invalid cursor: {token!r}')
+    return after
+
+
+def count_statement(statement, key):
+    """Turn a Core select into a bare SQL COUNT over the same rows."""
+    return statement.with_only_columns(func.count(key)).order_by(None)
+
+
+def page_query(query, args, key, per_page=QUESTIONS_PER_PAGE):
+    """Order ``query`` by ``key`` and limit it to one page plus one row.
+
+    ``args`` is a mapping of request parameters. A ``cursor`` (or ``after``)
+    token selects the keyset path, which seeks past the last seen key and costs
+    the same on every page; otherwise the classic ``page`` number is honoured
+    with an OFFSET. Works on ORM queries and Core selects alike.
+    """
+    query = query.order_by(key)
+    token = args.get('cursor') or args.get('after')
+    if token:
+        try:
+            after = decode_cursor(token)
+        except ValueError:
+            abort(400)
+        query = query.filter(key > after)
+    else:
+        try:
+            page = int(args.get('page', 1))
+        except (TypeError, ValueError):
+            abort(400)
+        if page < 1:
+            abort(404)
+        query = query.offset((page - 1) * per_page)
+    return query.limit(per_page + 1)
+
+
+def split_page(rows, per_page=QUESTIONS_PER_PAGE):
+    """Return ``(rows, next_cursor)`` from the rows fetched by ``page_query``."""
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        return rows, encode_cursor(rows[-1].id)
+    return rows, None
+
+
+def paginate(query, args, key, per_page=QUESTIONS_PER_PAGE):
+    """Fetch one page of ``query`` ordered by ``key`` with LIMIT in SQL.
+
+    Returns ``(rows, next_cursor)``; see ``page_query`` for the parameters.
+    """
+    return split_page(page_query(query, args, key, per_page).all(), per_page)
@@ -0,0 +1,321 @@
+import math
+import random
+import re
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+
+from sqlalchemy import func, select
+
+from models import db, Question
+from .stats import total_statement
+
+QUIZ_SESSION_URL = 'memory://'
+QUIZ_SESSION_TTL = 60 * 60
+SESSION_KEY_PREFIX = 'trivia:quiz:'
+SESSION_ID_RE = re.compile(r'[0-9a-f]{32}')
+# Fewest random ids tried per wanted question before falling back to a seek by rank
+PROBES_PER_QUESTION = 16
+# Most random ids looked up in one probe query, whatever the category's density
+MAX_PROBES = 2000
+# Chance the probes are allowed to miss a wanted question when the category is sparse
+MISS_ODDS = 0.01
+# Random ranks read per wanted question before excluding played ids in SQL
+RANK_ATTEMPTS = 4
+MAX_QUIZ_SESSIONS = 10000
+# Upper bound on ``count`` in POST /quizzes
+MAX_QUIZ_BATCH = 50
+
+
+def category_filter(query, category_id):
+    """Restrict ``query`` to one category; id 0 means every category."""
+    if category_id == 0:
+        return query
+    return query.filter(Question.category == category_id)
+
+
+# The statements below are plain Core selects so the WSGI app and the async
+# app (flaskr.asgi) can share them.
+
+def id_bounds_statement(category_id):
+    # One subquery per bound: SQLite only reads a single index entry for a
+    # query with one MIN or MAX, and scans the whole range for both at once.
+    return select(category_filter(select(func.min(Question.id)), category_id).scalar_subquery(),
+                  category_filter(select(func.max(Question.id)), category_id).scalar_subquery())
+
+
+def probe_statement(category_id, pivots, fields=Question.FIELDS):
+    """Select the questions of the category whose id is one of ``pivots``."""
+    return category_filter(select(*Question.columns(fields)), category_id).filter(
+        Question.id.in_(pivots))
+
+
+def rank_statement(category_id, rank, exclude=(), fields=Question.FIELDS):
+    """Select the question at 0-based ``rank`` in id order, skipping ``exclude``."""
+    statement = category_filter(select(*Question.columns(fields)), category_id)
+    if exclude:
+        statement = statement.filter(~Question.id.in_(exclude))
+    return statement.order_by(Question.id).offset(rank).limit(1)
+
+
+def excluded_count_statement(category_id, exclude):
+    """Count the ids of ``exclude`` that belong to the category."""
+    return category_filter(select(func.count(Question.id)), category_id).filter(
+        Question.id.in_(exclude))
+
+
+def format_row(row):
+    return dict(row._mapping) if row is not None else None
+
+
+def parse_count(value):
+    """Validate the optional ``count`` of a quiz request; ``None`` when absent."""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= MAX_QUIZ_BATCH:
+        raise ValueError(f'count must be an integer between 1 and {MAX_QUIZ_BATCH}')
+    return value
+
+
+def quiz_payload(questions, count, **extra):
+    """Reply body for POST /quizzes.
+
+    ``question`` is always the first pick, so clients that never send
+    ``count`` see no change; ``questions`` holds the whole batch.
+    """
+    payload = {'success': True, 'question': questions[0] if questions else None}
+    if count is not None:
+        payload['questions'] = questions
+    payload.update(extra)
+    return payload
+
+
+def probe_count(count, lowest, highest, free):
+    """Random ids to look up so that ``count`` hits are likely among ``free`` questions.
+
+    A random id between ``lowest`` and ``highest`` hits a free question
+    with chance ``free / span``. Enough ids are drawn for ``count`` hits
+    plus a margin, so a sparse category, a small one in a large bank, is
+    rarely left to the seek by rank. At least ``PROBES_PER_QUESTION`` per
+    question and at most ``MAX_PROBES`` are drawn.
+    """
+    density = min(max(free, 1) / (highest - lowest + 1), 1)
+    wanted = (count + math.log(1 / MISS_ODDS) * math.sqrt(count)) / density
+    return min(max(count * PROBES_PER_QUESTION, math.ceil(wanted)), MAX_PROBES)
+
+
+def draw_pivots(lowest, highest, probes):
+    return [random.randint(lowest, highest) for _ in range(probes)]
+
+
+def take_hits(pivots, rows, exclude, count):
+    """Format up to ``count`` distinct probed rows in the order their ids were drawn.
+
+    Every pivot is uniform over the id range, so the first pivot that lands
+    on a free question picks each free question with the same chance, and
+    so does every later one among the questions not yet picked.
+    """
+    found = {row.id: row for row in rows}
+    picked = {}
+    for pivot in pivots:
+        if len(picked) == count:
+            break
+        if pivot in found and pivot not in exclude and pivot not in picked:
+            picked[pivot] = format_row(found[pivot])
+    return list(picked.values())
+
+
+def draw_ranks(total, excluded, count):
+    """Distinct random ranks among the ``total - excluded`` free questions."""
+    available = max(total - excluded, 0)
+    return random.sample(range(available), min(count, available))
+
+
+def pick_random_questions(category_id, exclude=(), count=1, fields=Question.FIELDS):
+    """Pick up to ``count`` distinct random questions without loading the candidates.
+
+    Every free question of the category is equally likely. Random ids
+    between the smallest and largest id of the category are first looked
+    up together through the primary key; how many is set by
+    ``probe_count`` from the category's size in ``question_counts``, so
+    the batch is filled by this one query unless the category is very
+    sparse. The rest are picked by rank, a random offset read through
+    ``ix_questions_category_id``, which costs a walk of the index up to
+    that offset. While most of the category is free, the rank is drawn
+    over the whole category and played questions are drawn again; only
+    when most of it has been played are the played ids excluded in SQL.
+    Returns the formatted questions, with only ``fields``, fewer than
+    ``count`` when the category runs out.
+    """
+    lowest, highest = db.session.execute(id_bounds_statement(category_id)).one()
+    if lowest is None:
+        return []
+
+    exclude = set(exclude)
+    total = db.session.execute(total_statement(category_id or None)).scalar()
+    pivots = draw_pivots(lowest, highest, probe_count(count, lowest, highest, total - len(exclude)))
+    rows = db.session.execute(probe_statement(category_id, set(pivots), fields)).all()
+    questions = take_hits(pivots, rows, exclude, count)
+    exclude.update(question['id'] for question in questions)
+    if len(questions) < count and len(exclude) * 2 < total:
+        for _ in range((count - len(questions)) * RANK_ATTEMPTS):
+            row = db.session.execute(
+                rank_statement(category_id, random.randrange(total), fields=fields)).first()
+            if row is not None and row.id not in exclude:
+                exclude.add(row.id)
+                questions.append(format_row(row))
+                if len(questions) == count:
+                    break
+    if len(questions) < count:
+        excluded = (db.session.execute(excluded_count_statement(category_id, exclude)).scalar()
+                    if exclude else 0)
+        for rank in draw_ranks(total, excluded, count - len(questions)):
+            row = db.session.execute(rank_statement(category_id, rank, exclude, fields)).first()
+            if row is not None:
+                questions.append(format_row(row))
+    return questions
+
+
+class QuizSession:
+    """A quiz in progress: its category and the ids already played."""
+
+    __slots__ = ('id', 'category_id', 'seen', 'expires')
+
+    def __init__(self, category_id, seen, ttl, session_id=None):
+        self.id = session_id or uuid.uuid4().hex
+        self.category_id = category_id
+        self.seen = set(seen)
+        self.expires = time.monotonic() + ttl
+
+
+def is_session_id(value):
+    """Whether ``value`` has the shape of the ids ``QuizSession`` hands out."""
+    return isinstance(value, str) and SESSION_ID_RE.fullmatch(value) is not None
+
+
+class QuizSessionStore:
+    """Per-process registry of quiz sessions, evicted by age and count.
+
+    A session holds only the ids it has played, so starting one reads
+    nothing and each round is a random pick that excludes them.
+    """
+
+    # Calls never wait on the network, so the async app runs them inline.
+    blocking = False
+
+    def __init__(self, ttl=QUIZ_SESSION_TTL, max_sessions=MAX_QUIZ_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def start(self, category_id, seen=(), session_id=None):
+        """Register a session that never plays the ``seen`` ids.
+
+        ``session_id`` reuses an id this store does not know, such as one
+        handed out by another worker or expired here.
+        """
+        session = QuizSession(category_id, seen, self.ttl, session_id)
+        with self._lock:
+            self._sessions[session.id] = session
+            self._evict()
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if session.expires < time.monotonic():
+                del self._sessions[session_id]
+                return None
+            session.expires = time.monotonic() + self.ttl
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def played(self, session):
+        """A copy of the ids ``session`` has played."""
+        with self._lock:
+            return set(session.seen)
+
+    def record(self, session, question_ids):
+        with self._lock:
+            session.seen.update(question_ids)
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest.expires >= now and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+
+
+class RedisQuizSessionStore:
+    """Quiz sessions kept in a Redis-protocol server, shared by every worker.
+
+    A session is one string, ``<category>:`` followed by ``,<id>`` for each
+    played question, so recording a round is an ``APPEND``. Every call
+    renews the TTL.
+    """
+
+    blocking = True
+
+    def __init__(self, client, ttl=QUIZ_SESSION_TTL):
+        self.client = client
+        self.ttl = ttl
+
+    @classmethod
+    def from_url(cls, url, ttl=QUIZ_SESSION_TTL):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('QUIZ_SESSION_URL needs the redis package')
+        return cls(redis.Redis.from_url(url), ttl)
+
+    def start(self, category_id, seen=(), session_id=None):
+        session = QuizSession(category_id, seen, self.ttl, session_id)
+        value = f'{category_id}:' + ''.join(f',{question_id}' for question_id in session.seen)
+        self.client.set(SESSION_KEY_PREFIX + session.id, value, ex=self.ttl)
+        return session
+
+    def get(self, session_id):
+        key = SESSION_KEY_PREFIX + session_id
+        pipeline = self.client.pipeline()
+        pipeline.get(key)
+        pipeline.expire(key, self.ttl)
+        value = pipeline.execute()[0]
+        if value is None:
+            return None
+        category_id, separator, played = value.decode('ascii').partition(':')
+        if not separator:
+            # The key expired between a read and an APPEND that recreated it.
+            return None
+        return QuizSession(int(category_id), (int(question_id) for question_id
+                                              in played.split(',') if question_id),
+                           self.ttl, session_id)
+
+    def played(self, session):
+        return set(session.seen)
+
+    def record(self, session, question_ids):
+        if not question_ids:
+            return
+        key = SESSION_KEY_PREFIX + session.id
+        pipeline = self.client.pipeline()
+        pipeline.append(key, ''.join(f',{question_id}' for question_id in question_ids))
+        pipeline.expire(key, self.ttl)
+        pipeline.execute()
+        session.seen.update(question_ids)
+
+
+def create_session_store(url, ttl=QUIZ_SESSION_TTL):
+    if url.startswith('memory:'):
+        return QuizSessionStore(ttl)
+    if url.startswith(('redis:', 'rediss:', 'unix:')):
+        return RedisQuizSessionStore.from_url(url, ttl)
+    raise ValueError(f'unsupported QUIZ_SESSION_URL {url!r}')
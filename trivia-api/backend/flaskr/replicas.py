@@ -0,0 +1,54 @@
+import math
+import time
+from functools import wraps
+
+from flask import current_app, g, request
+
+from models import db
+from . import versions
+
+LAST_WRITE_COOKIE = 'trivia_last_write'
+
+
+def use_replica():
+    """Send the remaining reads of this request to a replica when safe.
+
+    Reads stay on the primary for ``lag_window`` seconds after a write,
+    both in the worker that committed it, so version-keyed caches are never
+    filled from a lagging replica, and for the client that made it, through
+    the ``trivia_last_write`` cookie, which gives read-your-writes across
+    workers.
+    """
+    router = current_app.extensions.get('replicas')
+    if not router:
+        return
+    if versions.seconds_since_bump() < router.lag_window:
+        return
+    last_write = request.cookies.get(LAST_WRITE_COOKIE, type=float)
+    if last_write is not None and time.time() - last_write < router.lag_window:
+        return
+    db.session.info['replica'] = router.choose()
+
+
+def read_only(view):
+    """Mark a view whose reads may be served by a replica."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        use_replica()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def init_replicas(app):
+    @app.before_request
+    def remember_versions():
+        g.versions_at_start = versions.snapshot()
+
+    @app.after_request
+    def mark_writer(response):
+        router = app.extensions.get('replicas')
+        if router and getattr(g, 'versions_at_start', None) != versions.snapshot():
+            response.set_cookie(LAST_WRITE_COOKIE, repr(time.time()),
+                                max_age=math.ceil(router.lag_window), httponly=True,
+                                samesite='Lax')
+        return response
@@ -0,0 +1,68 @@
+import re
+
+from sqlalchemy import func, literal_column, or_, select
+
+from models import db, Question, SEARCH_CONFIG
+from .pagination import QUESTIONS_PER_PAGE, count_statement
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def to_prefix_query(term):
+    """Turn free text into a tsquery string where every word is a prefix.
+
+    Only word characters survive, so user input can never inject tsquery
+    operators. Returns ``None`` when nothing searchable is left.
+    """
+    tokens = TOKEN_RE.findall(term.lower())
+    if not tokens:
+        return None
+    return ' & '.join(f'{token}:*' for token in tokens)
+
+
+def search_statement(term, dialect_name, fields=Question.FIELDS):
+    """Return ``(select, ordering)`` of ``fields`` for the questions matching ``term``.
+
+    On PostgreSQL the match runs against the GIN-indexed ``search_vector``
+    column and results are ordered by ``ts_rank_cd``, so hits in the question
+    text outrank hits in the answer. Other backends fall back to a substring
+    match ordered by id.
+    """
+    statement = select(*Question.columns(fields))
+    tsquery_text = to_prefix_query(term)
+    if tsquery_text is None:
+        return statement, [Question.id]
+
+    if dialect_name == 'postgresql':
+        vector = literal_column('questions.search_vector')
+        tsquery = func.to_tsquery(SEARCH_CONFIG, tsquery_text)
+        return (statement.filter(vector.op('@@')(tsquery)),
+                [func.ts_rank_cd(vector, tsquery).desc(), Question.id])
+
+    pattern = f'%{term}%'
+    return (statement.filter(or_(Question.question.ilike(pattern),
+                                 Question.answer.ilike(pattern))),
+            [Question.id])
+
+
+def search_key(term, dialect_name):
+    """Normalize ``term`` to what the search statement actually depends on.
+
+    PostgreSQL only sees the lowercased tokens, so "Water?" and "water"
+    share a key; the substring fallback depends on the exact term.
+    """
+    if dialect_name == 'postgresql':
+        return to_prefix_query(term) or ''
+    return term
+
+
+def search_page_statement(statement, ordering, page, per_page=QUESTIONS_PER_PAGE):
+    return statement.order_by(*ordering).offset((page - 1) * per_page).limit(per_page)
+
+
+def search_questions(term, page=1, per_page=QUESTIONS_PER_PAGE, fields=Question.FIELDS):
+    """Return ``(rows, total)`` for one page of search results."""
+    statement, ordering = search_statement(term, db.engine.dialect.name, fields)
+    total = db.session.execute(count_statement(statement, Question.id)).scalar()
+    rows = db.session.execute(search_page_statement(statement, ordering, page, per_page)).all()
+    return rows, total
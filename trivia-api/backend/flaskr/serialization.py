@@ -0,0 +1,113 @@
+"""Pluggable JSON encoding and negotiated response compression.
+
+``jsonify`` here replaces Flask's for every trivia endpoint. It encodes
+with orjson when installed, then msgspec, then the stdlib, or with the
+backend named by the ``JSON_SERIALIZER`` setting. ``compress_response`` is
+an ``after_request`` hook that gzips or brotli-compresses bodies above
+``COMPRESS_MIN_SIZE`` for clients that accept it.
+"""
+import gzip
+import json
+
+from flask import Response, current_app, request
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - optional speedup
+    msgspec = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional codec
+    brotli = None
+
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+ENCODINGS = ('br', 'gzip')
+
+
+def _stdlib_dumps(payload):
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+SERIALIZERS = {'json': _stdlib_dumps}
+if msgspec is not None:
+    SERIALIZERS['msgspec'] = msgspec.json.Encoder().encode
+if orjson is not None:
+    # Category maps are keyed by integer ids, which orjson only accepts
+    # with OPT_NON_STR_KEYS.
+    SERIALIZERS['orjson'] = lambda payload: orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+
+PREFERRED_SERIALIZERS = ('orjson', 'msgspec', 'json')
+
+
+def get_serializer(name=None):
+    """Return ``(name, dumps)`` for ``name`` or the fastest available one."""
+    if name:
+        if name not in SERIALIZERS:
+            raise ValueError(f'JSON serializer {name!r} is not installed')
+        return name, SERIALIZERS[name]
+    for candidate in PREFERRED_SERIALIZERS:
+        if candidate in SERIALIZERS:
+            return candidate, SERIALIZERS[candidate]
+
+
+def init_serializer(app):
+    name, dumps = get_serializer(app.config.get('JSON_SERIALIZER'))
+    app.config['JSON_SERIALIZER'] = name
+    app.extensions['json_dumps'] = dumps
+
+
+def jsonify(payload):
+    """Drop-in for ``flask.jsonify`` with a single dict argument."""
+    body = current_app.extensions['json_dumps'](payload)
+    return Response(body, mimetype='application/json')
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def choose_encoding(accept_encodings):
+    for encoding in ENCODINGS:
+        if encoding == 'br' and brotli is None:
+            continue
+        if accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def compress_response(response):
+    """Compress a buffered response body when it is worth it.
+
+    Streamed responses (exports) and already-encoded ones pass through.
+    A strong ETag gets the encoding appended, since the compressed bytes
+    are a different representation of the resource.
+    """
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    threshold = current_app.config.get('COMPRESS_MIN_SIZE', COMPRESS_MIN_SIZE)
+    if response.content_length is None or response.content_length < threshold:
+        return response
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f'{etag}-{encoding}')
+    return response
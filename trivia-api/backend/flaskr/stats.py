@@ -0,0 +1,131 @@
+"""Question counts per category and difficulty.
+
+``question_counts`` holds one row per (category, difficulty) pair and is
+changed in the same transaction as the write to ``questions`` it mirrors.
+ORM writes are counted by mapper events. Core writes (bulk import, batch
+mutations and the ASGI app) call ``adjust`` themselves. A total is then a
+SUM over a few dozen rows, not a COUNT over the whole table.
+"""
+from collections import Counter
+
+from sqlalchemy import event, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import attributes
+
+from models import db, Question, QuestionCount
+
+UPSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def _rows(deltas):
+    # Key order, so concurrent transactions lock the rows in the same order
+    # and cannot deadlock each other.
+    return [{'category': category, 'difficulty': difficulty, 'count': change}
+            for (category, difficulty), change in sorted(deltas.items()) if change]
+
+
+def adjust_statement(deltas, dialect_name):
+    """Build one upsert adding ``{(category, difficulty): change}`` to the counts.
+
+    Only for the dialects in ``UPSERTS``. Returns ``None`` when every change
+    is zero.
+    """
+    rows = _rows(deltas)
+    if not rows:
+        return None
+    counts = QuestionCount.__table__
+    statement = UPSERTS[dialect_name](counts).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=[counts.c.category, counts.c.difficulty],
+        set_={'count': counts.c.count + statement.excluded['count']})
+
+
+def adjust(deltas, connection=None):
+    """Apply ``deltas`` in the transaction of ``connection`` (default: the session).
+
+    Dialects without an upsert in ``UPSERTS`` get an UPDATE per pair and
+    an INSERT when no row matched. Two transactions creating the same pair
+    at once then fail on its primary key instead of losing a count.
+    """
+    executor = db.session if connection is None else connection
+    dialect_name = (db.engine if connection is None else connection).dialect.name
+    if dialect_name in UPSERTS:
+        statement = adjust_statement(deltas, dialect_name)
+        if statement is not None:
+            executor.execute(statement)
+        return
+    counts = QuestionCount.__table__
+    for row in _rows(deltas):
+        result = executor.execute(
+            update(counts).where(counts.c.category == row['category'],
+                                 counts.c.difficulty == row['difficulty'])
+            .values(count=counts.c.count + row['count']))
+        if result.rowcount == 0:
+            executor.execute(insert(counts).values(row))
+
+
+def total_statement(category_id=None):
+    """Select the number of questions, in one category or in all of them."""
+    statement = select(func.coalesce(func.sum(QuestionCount.count), 0))
+    if category_id is not None:
+        statement = statement.where(QuestionCount.category == category_id)
+    return statement
+
+
+def question_total(category_id=None):
+    return db.session.execute(total_statement(category_id)).scalar()
+
+
+def counts_statement():
+    """Select every non-zero ``(category, difficulty, count)`` row in key order."""
+    return (select(QuestionCount.category, QuestionCount.difficulty, QuestionCount.count)
+            .where(QuestionCount.count > 0)
+            .order_by(QuestionCount.category, QuestionCount.difficulty))
+
+
+def summarize(rows, category_ids=()):
+    """Totals overall, per category, per difficulty and per pair of both.
+
+    Every id in ``category_ids`` is listed, with 0 when it has no questions.
+    """
+    categories = dict.fromkeys(category_ids, 0)
+    difficulties = Counter()
+    for category, difficulty, count in rows:
+        categories[category] = categories.get(category, 0) + count
+        difficulties[difficulty] += count
+    return {
+        'total_questions': sum(count for _, _, count in rows),
+        'categories': categories,
+        'difficulties': dict(sorted(difficulties.items())),
+        'counts': [{'category': category, 'difficulty': difficulty, 'count': count}
+                   for category, difficulty, count in rows]
+    }
+
+
+def question_stats(category_ids=()):
+    return summarize(db.session.execute(counts_statement()).all(), category_ids)
+
+
+def _key(target):
+    return target.category, target.difficulty
+
+
+@event.listens_for(Question, 'after_insert')
+def _question_inserted(mapper, connection, target):
+    adjust({_key(target): 1}, connection)
+
+
+@event.listens_for(Question, 'after_delete')
+def _question_deleted(mapper, connection, target):
+    adjust({_key(target): -1}, connection)
+
+
+@event.listens_for(Question, 'after_update')
+def _question_updated(mapper, connection, target):
+    previous = []
+    for field in ('category', 'difficulty'):
+        history = attributes.get_history(target, field)
+        previous.append(history.deleted[0] if history.deleted else getattr(target, field))
+    deltas = Counter({tuple(previous): -1})
+    deltas[_key(target)] += 1
+    adjust(deltas, connection)
@@ -0,0 +1,244 @@
+"""Read-only, in-memory copy of the question bank.
+
+With ``QUESTION_STORE`` enabled, question lists and quiz picks are served
+from a column-oriented snapshot of ``questions`` instead of the database.
+Each column is one ``array`` and the question and answer texts are each a
+single UTF-8 blob with an offsets array, so a million questions are a
+dozen Python objects rather than millions. A ``gunicorn --preload`` master
+builds the snapshot once. Forked workers then share its pages
+copy-on-write, because serving a request never writes to them: not even a
+reference count changes on a per-row object.
+
+A snapshot is never changed in place. A write in this process bumps the
+``questions`` version, and the next read builds a new snapshot and swaps
+it in. Writes made by other processes are picked up once the snapshot is
+``QUESTION_STORE_MAX_AGE`` seconds old. While one request rebuilds, the
+others keep serving the previous snapshot.
+"""
+import random
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from threading import Lock
+
+from flask import abort
+
+from models import db, Question
+from . import versions
+from .cache import mark_stale_read
+from .pagination import QUESTIONS_PER_PAGE, decode_cursor, encode_cursor
+
+QUESTION_STORE_MAX_AGE = 300
+LOAD_BATCH_SIZE = 10000
+# Array attribute holding each numeric field; the texts are decoded from blobs.
+COLUMNS = {'id': 'ids', 'category': 'categories', 'difficulty': 'difficulties'}
+
+
+class QuestionSnapshot:
+    """Every question, one array per column, in id order."""
+
+    def __init__(self):
+        self.ids = array('q')
+        self.categories = array('i')
+        self.difficulties = array('i')
+        self.question_offsets = array('Q', [0])
+        self.answer_offsets = array('Q', [0])
+        self.question_text = b''
+        self.answer_text = b''
+        self.category_ids = {}
+
+    @classmethod
+    def load(cls, batch_size=LOAD_BATCH_SIZE):
+        """Read every question once, in id order."""
+        snapshot = cls()
+        questions, answers = bytearray(), bytearray()
+        category_ids = {}
+        rows = db.session.query(*Question.columns()).order_by(Question.id).yield_per(batch_size)
+        for question_id, question, answer, category, difficulty in rows:
+            snapshot.ids.append(question_id)
+            snapshot.categories.append(category)
+            snapshot.difficulties.append(difficulty)
+            questions += question.encode('utf-8')
+            answers += answer.encode('utf-8')
+            snapshot.question_offsets.append(len(questions))
+            snapshot.answer_offsets.append(len(answers))
+            category_array = category_ids.get(category)
+            if category_array is None:
+                category_array = category_ids[category] = array('q')
+            category_array.append(question_id)
+        snapshot.question_text = bytes(questions)
+        snapshot.answer_text = bytes(answers)
+        if max(len(questions), len(answers)) < 2 ** 32:
+            # Halve the offsets once the texts are known to fit.
+            snapshot.question_offsets = array('I', snapshot.question_offsets)
+            snapshot.answer_offsets = array('I', snapshot.answer_offsets)
+        snapshot.category_ids = category_ids
+        return snapshot
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the columns, the texts and the category id arrays."""
+        columns = (self.ids, self.categories, self.difficulties,
+                   self.question_offsets, self.answer_offsets)
+        return (sum(column.itemsize * len(column) for column in columns)
+                + len(self.question_text) + len(self.answer_text)
+                + sum(ids.itemsize * len(ids) for ids in self.category_ids.values()))
+
+    def ids_in(self, category_id):
+        """Ids of one category in ascending order; category 0 means all of them."""
+        if category_id == 0:
+            return self.ids
+        return self.category_ids.get(category_id, array('q'))
+
+    def count(self, category_id=0):
+        return len(self.ids_in(category_id))
+
+    def value(self, field, position):
+        """One field of the question at ``position``; only texts are decoded."""
+        if field == 'question':
+            blob, offsets = self.question_text, self.question_offsets
+        elif field == 'answer':
+            blob, offsets = self.answer_text, self.answer_offsets
+        else:
+            return getattr(self, COLUMNS[field])[position]
+        return blob[offsets[position]:offsets[position + 1]].decode('utf-8')
+
+    def row(self, position, fields=Question.FIELDS):
+        return {field: self.value(field, position) for field in fields}
+
+    def rows(self, question_ids, fields=Question.FIELDS):
+        """Return ``{id: question}`` for the ids that exist, with only ``fields``."""
+        rows = {}
+        for question_id in question_ids:
+            position = bisect_left(self.ids, question_id)
+            if position < len(self.ids) and self.ids[position] == question_id:
+                rows[question_id] = self.row(position, fields)
+        return rows
+
+    def page(self, args, category_id=0, per_page=QUESTIONS_PER_PAGE, fields=Question.FIELDS):
+        """Return ``(questions, next_cursor)`` with the semantics of ``paginate``."""
+        ids = self.ids_in(category_id)
+        token = args.get('cursor') or args.get('after')
+        if token:
+            try:
+                start = bisect_right(ids, decode_cursor(token))
+            except ValueError:
+                abort(400)
+        else:
+            try:
+                page = int(args.get('page', 1))
+            except (TypeError, ValueError):
+                abort(400)
+            if page < 1:
+                abort(404)
+            start = (page - 1) * per_page
+
+        page_ids = ids[start:start + per_page]
+        rows = self.rows(page_ids, fields)
+        questions = [rows[question_id] for question_id in page_ids]
+        next_cursor = None
+        if start + per_page < len(ids):
+            next_cursor = encode_cursor(page_ids[-1])
+        return questions, next_cursor
+
+    def pick_random(self, category_id, exclude=(), count=1, fields=Question.FIELDS):
+        """Pick up to ``count`` distinct random questions not in ``exclude``."""
+        candidates = self.ids_in(category_id)
+        exclude = set(exclude)
+        if len(exclude) + count <= len(candidates) // 2:
+            # Most candidates are free, so a draw is rejected less than
+            # half of the time and no candidate list is built.
+            picked = []
+            while len(picked) < count:
+                question_id = candidates[random.randrange(len(candidates))]
+                if question_id not in exclude:
+                    exclude.add(question_id)
+                    picked.append(question_id)
+        else:
+            remaining = [question_id for question_id in candidates if question_id not in exclude]
+            picked = random.sample(remaining, min(count, len(remaining)))
+        rows = self.rows(picked, fields)
+        return [rows[question_id] for question_id in picked]
+
+
+class QuestionStore:
+    """Holds the current snapshot and replaces it when it goes stale."""
+
+    def __init__(self, max_age=QUESTION_STORE_MAX_AGE):
+        self.loads = 0
+        self.load_seconds = 0.0
+        self._snapshot = None
+        self.freshness = versions.Freshness('questions', max_age)
+        self._lock = Lock()
+
+    def load(self):
+        version = self.freshness.start()
+        started = time.perf_counter()
+        snapshot = QuestionSnapshot.load()
+        self.load_seconds = time.perf_counter() - started
+        self.loads += 1
+        self._snapshot = snapshot
+        self.freshness.mark(version)
+        return snapshot
+
+    def snapshot(self):
+        """Return the current snapshot, rebuilding it first if it is stale.
+
+        Only the first request to see a stale snapshot rebuilds it; the
+        others go on with the previous one instead of waiting. A request
+        served that way is flagged with ``mark_stale_read``, so its reply
+        is neither cached nor tagged under the post-write versions.
+        """
+        if self._snapshot is None or self.freshness.stale():
+            if self._lock.acquire(blocking=self._snapshot is None):
+                try:
+                    if self._snapshot is None or self.freshness.stale():
+                        self.load()
+                finally:
+                    self._lock.release()
+            if self.freshness.stale():
+                mark_stale_read()
+        return self._snapshot
+
+    def render(self):
+        """Size and load figures in Prometheus text format."""
+        snapshot = self._snapshot
+        questions = len(snapshot) if snapshot is not None else 0
+        nbytes = snapshot.nbytes if snapshot is not None else 0
+        return ['# HELP trivia_question_store_questions Questions held by the in-memory store.',
+                '# TYPE trivia_question_store_questions gauge',
+                f'trivia_question_store_questions {questions}',
+                '# HELP trivia_question_store_bytes Bytes held by the in-memory store.',
+                '# TYPE trivia_question_store_bytes gauge',
+                f'trivia_question_store_bytes {nbytes}',
+                '# HELP trivia_question_store_loads_total Snapshots built since the worker started.',
+                '# TYPE trivia_question_store_loads_total counter',
+                f'trivia_question_store_loads_total {self.loads}',
+                '# HELP trivia_question_store_load_seconds Time taken by the last snapshot build.',
+                '# TYPE trivia_question_store_load_seconds gauge',
+                f'trivia_question_store_load_seconds {self.load_seconds:.6f}']
+
+
+def init_store(app):
+    """Build the store when ``QUESTION_STORE`` is set.
+
+    With ``QUESTION_STORE_PRELOAD`` the snapshot is loaded right away, so a
+    preloaded master shares it with the workers it forks. The pool is then
+    emptied, so no worker inherits the master's connection. Otherwise the
+    first request that needs it loads it.
+    """
+    if not app.config.get('QUESTION_STORE'):
+        app.extensions['question_store'] = None
+        return None
+    store = app.extensions['question_store'] = QuestionStore(
+        app.config.get('QUESTION_STORE_MAX_AGE', QUESTION_STORE_MAX_AGE))
+    app.extensions['metrics'].add_collector(store.render)
+    if app.config.get('QUESTION_STORE_PRELOAD', True):
+        with app.app_context():
+            store.load()
+            db.session.remove()
+        db.get_engine(app).dispose()
+    return store
@@ -0,0 +1,190 @@
+"""In-memory prefix index for search-as-you-type.
+
+Every distinct word of two or more characters in the questions and answers
+is kept in a sorted array, next to the number of times it occurs.
+A prefix lookup is a binary search for the range of matching words plus a
+top-k by count over that range. No database query is made per keystroke.
+
+ORM inserts, updates and deletes of questions are applied to the index
+incrementally once they commit. Any other write, such as a bulk import, a
+batch mutation or an ASGI write, only bumps the ``questions`` data version,
+and the index is then rebuilt from the table on the next lookup. Writes
+served by other workers are picked up by a rebuild once the index is
+``SUGGEST_MAX_AGE`` seconds old; that lookup rebuilds it while the others
+keep using the old one.
+"""
+import heapq
+import weakref
+from bisect import bisect_left, insort
+from collections import Counter
+from itertools import islice
+from threading import Lock
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, attributes, object_session
+
+from models import db, Question
+from . import versions
+from .search import TOKEN_RE
+
+SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 50
+MIN_TOKEN_LENGTH = 2
+REBUILD_BATCH_SIZE = 5000
+MAX_CACHED_PREFIXES = 4096
+SUGGEST_MAX_AGE = 300
+
+_indexes = weakref.WeakSet()
+
+
+def tokenize(*texts):
+    """Count the lowercased words of ``texts`` worth completing."""
+    counts = Counter(TOKEN_RE.findall(' '.join(text for text in texts if text).lower()))
+    return Counter({token: count for token, count in counts.items()
+                    if len(token) >= MIN_TOKEN_LENGTH})
+
+
+class SuggestIndex:
+
+    def __init__(self, max_age=SUGGEST_MAX_AGE):
+        self.freshness = versions.Freshness('questions', max_age)
+        self._counts = {}
+        self._tokens = []
+        self._results = {}
+        self._lock = Lock()
+        self._rebuild_lock = Lock()
+        _indexes.add(self)
+
+    def __len__(self):
+        return len(self._tokens)
+
+    @property
+    def version(self):
+        return self.freshness.version
+
+    def rebuild(self, wait=True):
+        """Read every question once and replace the index.
+
+        Without ``wait``, return at once if another thread is rebuilding.
+        """
+        if not self._rebuild_lock.acquire(blocking=wait):
+            return
+        try:
+            if not self.freshness.stale():
+                return
+            version = self.freshness.start()
+            counts = Counter()
+            rows = iter(db.session.query(Question.question, Question.answer)
+                        .yield_per(REBUILD_BATCH_SIZE))
+            # One findall over a whole batch keeps the scan in C.
+            for batch in iter(lambda: list(islice(rows, REBUILD_BATCH_SIZE)), []):
+                counts.update(TOKEN_RE.findall(
+                    ' '.join(f'{question} {answer}' for question, answer in batch).lower()))
+            counts = {token: count for token, count in counts.items()
+                      if len(token) >= MIN_TOKEN_LENGTH}
+            with self._lock:
+                self._counts = counts
+                self._tokens = sorted(counts)
+                self._results = {}
+                self.freshness.mark(version)
+        finally:
+            self._rebuild_lock.release()
+
+    def apply(self, changes, version):
+        """Apply committed ``(old_tokens, new_tokens)`` word counts.
+
+        They are only applied when they explain the one version bump since
+        the index was last in sync. Otherwise some other write happened in
+        between, and the index is left stale so the next lookup rebuilds it.
+        """
+        with self._lock:
+            if self.freshness.version is None or self.freshness.version != version - 1:
+                return
+            for old_tokens, new_tokens in changes:
+                for token, count in (old_tokens - new_tokens).items():
+                    self._remove(token, count)
+                for token, count in (new_tokens - old_tokens).items():
+                    self._add(token, count)
+            self._results = {}
+            # Only this process's own write is applied: the build age stays.
+            self.freshness.version = version
+
+    def _add(self, token, count):
+        current = self._counts.get(token, 0)
+        if current == 0:
+            insort(self._tokens, token)
+        self._counts[token] = current + count
+
+    def _remove(self, token, count):
+        current = self._counts.get(token, 0)
+        if current > count:
+            self._counts[token] = current - count
+        elif current:
+            del self._counts[token]
+            del self._tokens[bisect_left(self._tokens, token)]
+
+    def complete(self, prefix, limit=SUGGEST_LIMIT):
+        """Return up to ``limit`` words starting with ``prefix``, most common first."""
+        if self.freshness.changed():
+            self.rebuild()
+        elif self.freshness.expired():
+            # Only other workers' writes can be missing: keep serving the
+            # current index rather than wait for the rebuild.
+            self.rebuild(wait=False)
+        key = (prefix, limit)
+        results = self._results.get(key)
+        if results is not None:
+            return results
+
+        with self._lock:
+            tokens, counts = self._tokens, self._counts
+            start = bisect_left(tokens, prefix)
+            end = bisect_left(tokens, prefix + '\U0010ffff', start)
+            # Ties keep alphabetical order, since nlargest is stable.
+            results = heapq.nlargest(limit, (tokens[position] for position in range(start, end)),
+                                     key=counts.__getitem__)
+            if len(self._results) >= MAX_CACHED_PREFIXES:
+                self._results = {}
+            self._results[key] = results
+        return results
+
+
+def _record(session, old_tokens, new_tokens):
+    if session is not None and old_tokens != new_tokens:
+        session.info.setdefault('suggest_changes', []).append((old_tokens, new_tokens))
+
+
+@event.listens_for(Question, 'after_insert')
+def _question_inserted(mapper, connection, target):
+    _record(object_session(target), Counter(), tokenize(target.question, target.answer))
+
+
+@event.listens_for(Question, 'after_delete')
+def _question_deleted(mapper, connection, target):
+    _record(object_session(target), tokenize(target.question, target.answer), Counter())
+
+
+@event.listens_for(Question, 'after_update')
+def _question_updated(mapper, connection, target):
+    previous = {}
+    for field in ('question', 'answer'):
+        history = attributes.get_history(target, field)
+        previous[field] = history.deleted[0] if history.deleted else getattr(target, field)
+    _record(object_session(target), tokenize(previous['question'], previous['answer']),
+            tokenize(target.question, target.answer))
+
+
+# Registered after flaskr.versions' own after_commit listener, so the
+# questions version has already been bumped for this commit when it runs.
+@event.listens_for(Session, 'after_commit')
+def _apply_committed(session):
+    changes = session.info.pop('suggest_changes', None)
+    if changes:
+        version = versions.current('questions')
+        for index in list(_indexes):
+            index.apply(changes, version)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_rolled_back(session, previous_transaction):
+    session.info.pop('suggest_changes', None)
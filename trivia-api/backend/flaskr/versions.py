@@ -0,0 +1,135 @@
+"""Per-process data version counters, one per table.
+
+Every committed ORM write to ``questions`` or ``categories`` bumps the
+matching counter, so anything derived from those tables can tell whether it
+is stale with a single integer comparison. Core statements that bypass the
+ORM (bulk import, batch mutations) call ``bump`` themselves after commit.
+
+The counters only see this process's writes. Whatever relies on them also
+expires on age (``DATA_VERSION_MAX_AGE`` for ETags and categories), so a
+write served by another worker shows up within that bound.
+"""
+import time
+import weakref
+from threading import Lock
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import Question, Category
+
+TABLES = ('questions', 'categories')
+DATA_VERSION_MAX_AGE = 30
+
+_lock = Lock()
+_versions = dict.fromkeys(TABLES, 0)
+_last_bump = float('-inf')
+_listeners = []
+
+
+def current(table):
+    return _versions[table]
+
+
+def snapshot(*tables):
+    """Return the versions of ``tables`` (all by default) as a tuple."""
+    return tuple(_versions[table] for table in tables or TABLES)
+
+
+def epoch(max_age=DATA_VERSION_MAX_AGE):
+    """Number of the current ``max_age``-second wall-clock period.
+
+    Every process moves to the next period at the same moment, so it can
+    tag anything built from the counters without agreeing on them.
+    """
+    return int(time.time() // max_age)
+
+
+class Freshness:
+    """Which version of ``table`` something was built from, and when.
+
+    Read ``start()`` before reading the table: a write that lands while
+    the table is read leaves the recorded version behind, so the next check
+    finds it stale and rebuilds again. ``max_age`` bounds how long the
+    build is trusted, since the counters miss other processes' writes.
+    """
+
+    def __init__(self, table, max_age=DATA_VERSION_MAX_AGE):
+        self.table = table
+        self.max_age = max_age
+        self.version = None
+        self.built_at = float('-inf')
+
+    def start(self):
+        return current(self.table)
+
+    def mark(self, version):
+        self.version = version
+        self.built_at = time.monotonic()
+
+    def changed(self):
+        """Whether this process has written ``table`` since the build."""
+        return self.version != current(self.table)
+
+    def expired(self):
+        return time.monotonic() - self.built_at > self.max_age
+
+    def stale(self):
+        return self.changed() or self.expired()
+
+    def reset(self):
+        self.version = None
+
+
+def bump(*tables):
+    global _last_bump
+    with _lock:
+        for table in tables:
+            _versions[table] += 1
+        _last_bump = time.monotonic()
+        listeners = list(_listeners)
+    for listener in listeners:
+        callback = listener()
+        if callback is None:
+            with _lock:
+                if listener in _listeners:
+                    _listeners.remove(listener)
+        else:
+            callback(tables)
+
+
+def on_bump(callback):
+    """Call the bound method ``callback(tables)`` after every bump.
+
+    Only a weak reference is kept, so the listener goes away with its owner.
+    """
+    with _lock:
+        _listeners.append(weakref.WeakMethod(callback))
+
+
+def seconds_since_bump():
+    """Seconds since this process last committed a write."""
+    return time.monotonic() - _last_bump
+
+
+def _track(table):
+    def touched(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('touched_tables', set()).add(table)
+    return touched
+
+
+for _model in (Question, Category):
+    for _name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _name, _track(_model.__tablename__))
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_soft_rollback')
+def _bump_touched(session, *args):
+    # Bumping only once the transaction has ended means no reader can cache
+    # the pre-write rows under the post-write version.
+    touched = session.info.pop('touched_tables', None)
+    if touched:
+        bump(*touched)
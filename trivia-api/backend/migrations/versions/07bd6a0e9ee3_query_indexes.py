@@ -0,0 +1,40 @@
+"""indexes for the category, difficulty and quiz query shapes
+
+Revision ID: 07bd6a0e9ee3
+Revises: bb125eeee642
+Create Date: 2026-10-17 09:34:27.902116
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '07bd6a0e9ee3'
+down_revision = 'bb125eeee642'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    # WHERE category = ? [AND id > ?] ORDER BY id: category pages, quiz
+    # seeks and min/max id bounds, and the foreign key lookups.
+    'ix_questions_category_id': ['category', 'id'],
+    # WHERE difficulty = ? [AND category = ?]: batch filters, and the
+    # question_counts recount reads only this index. A category-first order
+    # would draw category lookups away from the index above, which also
+    # returns them in id order.
+    'ix_questions_difficulty_category_id': ['difficulty', 'category', 'id'],
+}
+
+
+def upgrade():
+    # setup_db() created ix_questions_category_id before migrations existed.
+    existing = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('questions')}
+    for name, columns in INDEXES.items():
+        if name not in existing:
+            op.create_index(name, 'questions', columns)
+
+
+def downgrade():
+    for name in reversed(list(INDEXES)):
+        op.drop_index(name, table_name='questions')
@@ -0,0 +1,35 @@
+"""question_counts table, backfilled from questions
+
+Revision ID: 5f8b75bb71f9
+Revises: 8f6b8ac0a1ec
+Create Date: 2026-10-17 09:58:10.624390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f8b75bb71f9'
+down_revision = '8f6b8ac0a1ec'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if 'question_counts' not in sa.inspect(bind).get_table_names():
+        op.create_table('question_counts',
+        sa.Column('category', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('difficulty', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('category', 'difficulty')
+        )
+    if bind.execute(sa.text('SELECT 1 FROM question_counts LIMIT 1')).first() is None:
+        op.execute('INSERT INTO question_counts (category, difficulty, count) '
+                   'SELECT category, difficulty, count(*) FROM questions '
+                   'GROUP BY difficulty, category')
+
+
+def downgrade():
+    op.drop_table('question_counts')
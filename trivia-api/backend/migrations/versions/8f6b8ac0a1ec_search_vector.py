@@ -0,0 +1,41 @@
+"""generated search_vector column and GIN index on PostgreSQL
+
+Revision ID: 8f6b8ac0a1ec
+Revises: 07bd6a0e9ee3
+Create Date: 2026-10-17 09:41:55.170448
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8f6b8ac0a1ec'
+down_revision = '07bd6a0e9ee3'
+branch_labels = None
+depends_on = None
+
+# Matches models.SEARCH_CONFIG when this revision was written.
+SEARCH_CONFIG = 'simple'
+
+
+def upgrade():
+    # The column is not mapped on the model and other databases fall back
+    # to a substring search, so there is nothing to do outside PostgreSQL.
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute(
+        "ALTER TABLE questions ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        "GENERATED ALWAYS AS ("
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(question, '')), 'A') || "
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(answer, '')), 'B')"
+        ") STORED"
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_questions_search_vector "
+               "ON questions USING GIN (search_vector)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("DROP INDEX IF EXISTS ix_questions_search_vector")
+    op.execute("ALTER TABLE questions DROP COLUMN IF EXISTS search_vector")
@@ -0,0 +1,42 @@
+"""initial schema
+
+Revision ID: a705b021d580
+Revises: 
+Create Date: 2026-10-17 09:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a705b021d580'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases built by db.create_all() before migrations existed already
+    # have these tables; leave them as they are.
+    existing = sa.inspect(op.get_bind()).get_table_names()
+    if 'categories' not in existing:
+        op.create_table('categories',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+        )
+    if 'questions' not in existing:
+        op.create_table('questions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('question', sa.String(), nullable=False),
+        sa.Column('answer', sa.String(), nullable=False),
+        sa.Column('category', sa.Integer(), nullable=False),
+        sa.Column('difficulty', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('questions')
+    op.drop_table('categories')
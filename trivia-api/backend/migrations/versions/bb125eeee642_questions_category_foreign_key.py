@@ -0,0 +1,40 @@
+"""questions.category references categories.id
+
+Revision ID: bb125eeee642
+Revises: a705b021d580
+Create Date: 2026-10-17 09:20:03.551872
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bb125eeee642'
+down_revision = 'a705b021d580'
+branch_labels = None
+depends_on = None
+
+FOREIGN_KEY = 'fk_questions_category_categories'
+
+
+def upgrade():
+    bind = op.get_bind()
+    foreign_keys = sa.inspect(bind).get_foreign_keys('questions')
+    if any(key['referred_table'] == 'categories' for key in foreign_keys):
+        return
+    orphans = bind.execute(sa.text(
+        'SELECT count(*) FROM questions WHERE category NOT IN (SELECT id FROM categories)'
+    )).scalar()
+    if orphans:
+        raise RuntimeError(f'{orphans} questions point at a missing category; '
+                           'fix or delete them before adding the foreign key')
+    # Batch mode rebuilds the table on SQLite, which cannot add a constraint
+    # in place; PostgreSQL gets a plain ALTER TABLE.
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.create_foreign_key(FOREIGN_KEY, 'categories', ['category'], ['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.drop_constraint(FOREIGN_KEY, type_='foreignkey')
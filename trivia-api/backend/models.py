@@ -1,10 +1,19 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
-from dotenv import load_dotenv
+import random
+import time
+from itertools import count
+from threading import Lock
+from sqlalchemy import Column, ForeignKey, String, Integer, Index, create_engine, func, insert, select, text
+from sqlalchemy.orm import column_property, sessionmaker
+from sqlalchemy.pool import QueuePool
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
 
-load_dotenv()
+# Deployments that set their environment directly can skip the search for
+# a .env file (and importing python-dotenv) with LOAD_DOTENV=false.
+if os.getenv("LOAD_DOTENV", "true").lower() in ("1", "true", "yes"):
+    from dotenv import load_dotenv
+    load_dotenv()
 
 # Default DB settings pulled from environment
 DB_NAME = os.getenv("DB_NAME", "trivia")
@@ -23,26 +32,267 @@ database_path = os.getenv(
     f"postgresql://{credentials}{DB_HOST}:{DB_PORT}/{DB_NAME}"
 )
 
-db = SQLAlchemy()
+# Optional read replicas, comma separated, for read-only endpoints
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",")
+                         if url.strip()]
+DB_REPLICA_POLICY = os.getenv("DB_REPLICA_POLICY", "round_robin")
+# Seconds after a write during which reads stay on the primary
+DB_REPLICA_LAG_WINDOW = float(os.getenv("DB_REPLICA_LAG_WINDOW", "5"))
 
+# Connection pool settings, per worker process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
 
-def setup_db(app, database_path=database_path):
-    """Bind a flask application and a SQLAlchemy service."""
+# Create missing tables and indexes whenever an app is built. Production
+# should set DB_CREATE_SCHEMA=false and run `flask init-db` once per deploy,
+# so worker boots do not pay for the catalog round trips.
+DB_CREATE_SCHEMA = os.getenv("DB_CREATE_SCHEMA", "true").lower() in ("1", "true", "yes")
+
+# The 'simple' configuration keeps stop words such as "what" searchable and
+# does not stem, which suits short trivia questions and answers.
+SEARCH_CONFIG = "simple"
+
+SEARCH_INDEX_DDL = (
+    "ALTER TABLE questions ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS ("
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(question, '')), 'A') || "
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(answer, '')), 'B')"
+    ") STORED",
+    "CREATE INDEX IF NOT EXISTS ix_questions_search_vector "
+    "ON questions USING GIN (search_vector)",
+)
+
+class RoutingSession(SignallingSession):
+    """Session that sends reads to ``info['replica']`` when one is set.
+
+    Flushes, Core INSERT/UPDATE/DELETE statements and anything issued after
+    the session has written go to the primary, and the session stays there
+    for the rest of the request.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        replica = self.info.get('replica')
+        if replica is not None:
+            if self._flushing or getattr(clause, 'is_dml', False):
+                self.info['replica'] = None
+            else:
+                return replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class ReplicaRouter:
+    """Spreads read-only work over replica engines."""
+
+    POLICIES = ('round_robin', 'random')
+
+    def __init__(self, database_paths, policy=DB_REPLICA_POLICY, lag_window=DB_REPLICA_LAG_WINDOW):
+        if policy not in self.POLICIES:
+            raise ValueError(f'unknown replica policy {policy!r}')
+        self.engines = [create_engine(path, **engine_options(path)) for path in database_paths]
+        self.policy = policy
+        self.lag_window = lag_window
+        self._counter = count()
+
+    def __bool__(self):
+        return bool(self.engines)
+
+    def choose(self):
+        if not self.engines:
+            return None
+        if self.policy == 'random':
+            return random.choice(self.engines)
+        return self.engines[next(self._counter) % len(self.engines)]
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+
+
+db = RoutingSQLAlchemy()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+    def stats(self):
+        limit = self.size() + max(self._max_overflow, 0)
+        checked_out = self.checkedout()
+        return {
+            'size': self.size(),
+            'max_overflow': self._max_overflow,
+            'checked_out': checked_out,
+            'checked_in': self.checkedin(),
+            'overflow': max(self.overflow(), 0),
+            'saturated': self._max_overflow >= 0 and checked_out >= limit,
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'wait_avg_ms': round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            'wait_max_ms': round(self.wait_max * 1000, 3),
+        }
+
+
+def engine_options(database_path):
+    """Pool settings from the DB_POOL_* environment variables.
+
+    In-memory SQLite keeps SQLAlchemy's default single-connection pool.
+    """
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    if database_path in ("sqlite://", "sqlite:///:memory:"):
+        return options
+    options.update(
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    return options
+
+
+def pool_stats(engine):
+    """Live checkout and wait figures for ``engine``'s pool, if it keeps any."""
+    pool = engine.pool
+    if isinstance(pool, InstrumentedQueuePool):
+        return pool.stats()
+    return {'status': pool.status(), 'saturated': False}
+
+
+def setup_db(app, database_path=database_path, replica_paths=None, replica_policy=DB_REPLICA_POLICY,
+             replica_lag_window=DB_REPLICA_LAG_WINDOW, create_schema=DB_CREATE_SCHEMA):
+    """Bind a flask application and a SQLAlchemy service.
+
+    ``replica_paths`` (default: ``DATABASE_REPLICA_URLS``) lists read
+    replicas; the router is kept in ``app.extensions['replicas']``. With
+    ``create_schema`` false no connection is opened until the first query.
+    """
+    if replica_paths is None:
+        replica_paths = DATABASE_REPLICA_URLS
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
+    app.extensions['replicas'] = ReplicaRouter(replica_paths, replica_policy, replica_lag_window)
     db.app = app
     db.init_app(app)
+    # Building the engine opens no connection, and doing it here lets
+    # workers forked from a preloaded app inherit it instead of each
+    # paying for dialect setup on their first request.
+    db.get_engine(app)
+    if create_schema:
+        setup_schema()
+
+
+def setup_schema():
+    """Create missing tables, model indexes and the search index."""
     db.create_all()
+    setup_indexes()
+    setup_search_index()
+    rebuild_question_counts(only_if_empty=True)
+
+
+def setup_indexes():
+    """Create indexes declared on the models that an older schema lacks.
+
+    ``create_all`` skips tables that already exist, so indexes added to a
+    model later would otherwise never reach existing databases.
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+def setup_search_index():
+    """Add the generated tsvector column and its GIN index on PostgreSQL.
+
+    The column is maintained by PostgreSQL itself (12+), so every insert and
+    update keeps it in sync. It is left out of the mapped model on purpose,
+    which keeps other backends working without full-text search.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return
+    with db.engine.begin() as connection:
+        for statement in SEARCH_INDEX_DDL:
+            connection.execute(text(statement))
+
+
+def rebuild_question_counts(only_if_empty=False):
+    """Recount ``question_counts`` from ``questions`` in one transaction.
+
+    With ``only_if_empty`` a table that already holds counts is left alone,
+    which backfills it once when the schema is set up over existing data.
+    """
+    counts = QuestionCount.__table__
+    if only_if_empty and db.session.execute(select(counts.c.category).limit(1)).first():
+        db.session.commit()
+        return
+    if db.engine.dialect.name == 'postgresql':
+        # Hold off writers, and any other rebuild, until the recount commits.
+        db.session.execute(text('LOCK TABLE questions IN SHARE ROW EXCLUSIVE MODE'))
+    db.session.execute(counts.delete())
+    db.session.execute(insert(counts).from_select(
+        ['category', 'difficulty', 'count'],
+        select(Question.category, Question.difficulty, func.count())
+        .group_by(Question.difficulty, Question.category)))
+    db.session.commit()
 
 
 class Question(db.Model):
     __tablename__ = 'questions'
 
+    # Each index matches a query shape; migrations/ creates them on existing
+    # databases and benchmarks/query_plans.py checks the planner uses them.
+    __table_args__ = (
+        # Keyset pages within a category, quiz seeks and id bounds
+        # (WHERE category = ? AND id > ? ORDER BY id).
+        Index('ix_questions_category_id', 'category', 'id'),
+        # Batch filters on difficulty, or on both columns, and the
+        # question_counts recount. Leading with difficulty keeps category
+        # lookups on the index above, which also orders them by id.
+        Index('ix_questions_difficulty_category_id', 'difficulty', 'category', 'id'),
+    )
+
+    FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
     id = Column(Integer, primary_key=True)
     question = Column(String, nullable=False)
     answer = Column(String, nullable=False)
-    category = Column(Integer, nullable=False)
-    difficulty = Column(Integer, nullable=False)
+    # active_history loads the old value before an expired attribute is
+    # set, so the question counts can move the row to its new key.
+    category = column_property(
+        Column(Integer, ForeignKey('categories.id', name='fk_questions_category_categories'),
+               nullable=False),
+        active_history=True)
+    difficulty = column_property(Column(Integer, nullable=False), active_history=True)
 
     def __init__(self, question, answer, category, difficulty):
         self.question = question
@@ -70,6 +320,36 @@ class Question(db.Model):
             'difficulty': self.difficulty
         }
 
+    @classmethod
+    def columns(cls, fields=FIELDS):
+        return tuple(getattr(cls, field) for field in fields)
+
+    @classmethod
+    def rows(cls, fields=FIELDS):
+        """Query only ``fields`` as plain rows, without building ORM objects."""
+        return db.session.query(*cls.columns(fields))
+
+    @staticmethod
+    def format_rows(rows):
+        """Turn rows from ``Question.rows()`` into response dicts in one pass."""
+        if not rows:
+            return []
+        keys = rows[0]._fields
+        return [dict(zip(keys, row)) for row in rows]
+
+
+class QuestionCount(db.Model):
+    """Number of questions per category and difficulty.
+
+    Kept in step with ``questions`` by ``flaskr.stats`` in the same
+    transaction as every write, so totals never need a COUNT over the table.
+    """
+    __tablename__ = 'question_counts'
+
+    category = Column(Integer, primary_key=True, autoincrement=False)
+    difficulty = Column(Integer, primary_key=True, autoincrement=False)
+    count = Column(Integer, nullable=False, default=0)
+
 
 class Category(db.Model):
     __tablename__ = 'categories'
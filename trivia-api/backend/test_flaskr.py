@@ -1,61 +1,321 @@
+import asyncio
+import gzip
 import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from collections import Counter
+from functools import lru_cache
+from unittest.mock import patch
 import json
-from flask_sqlalchemy import SQLAlchemy
 from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
 
-from flaskr import create_app
-from models import setup_db, Question, Category
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+try:
+    from fakeredis import TcpFakeServer
+except ImportError:
+    TcpFakeServer = None
+try:
+    # Imported before create_app() so the app registers Flask-Migrate.
+    import flask_migrate
+    from alembic.autogenerate import compare_metadata
+    from alembic.migration import MigrationContext
+except ImportError:
+    flask_migrate = None
 
+from benchmarks.query_plans import check_plans
+from flaskr import create_app, quiz, stats, versions
+from flaskr.asgi import create_asgi_app
+from flaskr.pagination import encode_cursor
+from flaskr.quiz import pick_random_questions
+from models import db, setup_schema, Question, QuestionCount, Category
+
+
+@lru_cache(maxsize=None)
+def worker_database_url():
+    """The test database, suffixed per pytest-xdist worker (gw0, gw1, ...).
+
+    A PostgreSQL worker database is cloned from the base test database,
+    which must exist; a SQLite file gets a sibling file per worker.
+    """
+    load_dotenv()
+    database_name = os.getenv("TEST_DB_NAME", "trivia_test")
+    db_user = os.getenv("DB_USER", "postgres")
+    db_password = os.getenv("DB_PASSWORD", "")
+    db_host = os.getenv("DB_HOST", "localhost")
+    db_port = os.getenv("DB_PORT", "5432")
+
+    if db_password:
+        creds = f"{db_user}:{db_password}@"
+    else:
+        creds = f"{db_user}@"
+
+    database_path = (
+        os.getenv("TEST_DATABASE_URL")
+        or os.getenv("DATABASE_URL")
+        or f"postgresql://{creds}{db_host}:{db_port}/{database_name}"
+    )
+    worker = os.getenv("PYTEST_XDIST_WORKER")
+    url = make_url(database_path)
+    if not worker or url.database in (None, "", ":memory:"):
+        return database_path
+
+    if url.get_backend_name() == "sqlite":
+        root, extension = os.path.splitext(url.database)
+        return url.set(database=f"{root}_{worker}{extension}").render_as_string(hide_password=False)
+
+    worker_database = f"{url.database}_{worker}"
+    engine = create_engine(url.set(database="postgres"), isolation_level="AUTOCOMMIT")
+    with engine.connect() as connection:
+        connection.execute(text(f'DROP DATABASE IF EXISTS "{worker_database}"'))
+        connection.execute(text(f'CREATE DATABASE "{worker_database}" TEMPLATE "{url.database}"'))
+    engine.dispose()
+    return url.set(database=worker_database).render_as_string(hide_password=False)
+
+
+def seed_data():
+    category1 = Category(type='Science')
+    category2 = Category(type='Art')
+    db.session.add_all([category1, category2])
+    db.session.commit()
+
+    question1 = Question(question='What is H2O?', answer='Water', category=category1.id, difficulty=1)
+    question2 = Question(question='Who painted Mona Lisa?', answer='Da Vinci', category=category2.id, difficulty=2)
+    db.session.add_all([question1, question2])
+    db.session.commit()
+
+
+_prepared_databases = set()
 
-class TriviaTestCase(unittest.TestCase):
-    """This class represents the trivia test case"""
+
+def prepare_database(app, database_path):
+    """Rebuild the schema and seed it, once per worker process."""
+    if database_path in _prepared_databases:
+        return
+    with app.app_context():
+        db.drop_all()
+        setup_schema()
+        seed_data()
+        db.session.remove()
+    _prepared_databases.add(database_path)
+
+
+def use_savepoints(engine):
+    """Let pysqlite run SAVEPOINTs inside an outer transaction.
+
+    The driver manages BEGIN itself and gets it wrong around savepoints,
+    so take that over, as the SQLAlchemy SQLite dialect docs recommend.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def disable_pysqlite_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        connection.exec_driver_sql('BEGIN')
+
+
+class TriviaTestBase(unittest.TestCase):
+    """Builds the app for each test against a schema built once per worker.
+
+    Each test runs inside a transaction that is rolled back afterwards. The
+    app's own commits and rollbacks end a SAVEPOINT instead, which is
+    reopened straight away. Subclasses that need committed rows (another
+    engine has to see them) set ``transactional = False``. ``app_config``
+    is passed on to ``create_app``.
+    """
+
+    transactional = True
+    app_config = {}
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        self.database_path = worker_database_url()
+        self.app = create_app({'DATABASE_URL': self.database_path, 'DB_CREATE_SCHEMA': False,
+                               **self.app_config})
         self.client = self.app.test_client
-        load_dotenv()
-        self.database_name = os.getenv("TEST_DB_NAME", "trivia_test")
-        db_user = os.getenv("DB_USER", "postgres")
-        db_password = os.getenv("DB_PASSWORD", "")
-        db_host = os.getenv("DB_HOST", "localhost")
-        db_port = os.getenv("DB_PORT", "5432")
-
-        if db_password:
-            creds = f"{db_user}:{db_password}@"
-        else:
-            creds = f"{db_user}@"
-
-        self.database_path = (
-            os.getenv("TEST_DATABASE_URL")
-            or os.getenv("DATABASE_URL")
-            or f"postgresql://{creds}{db_host}:{db_port}/{self.database_name}"
-        )
-        setup_db(self.app, self.database_path)
-
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            self.db.drop_all()
-            self.db.create_all()
-            self.seed_data()
+        self.db = db
+        engine = db.get_engine(self.app)
+        use_savepoints(engine)
+        prepare_database(self.app, self.database_path)
+        if not self.transactional:
+            return
+
+        self.connection = engine.connect()
+        self.transaction = self.connection.begin()
+        self.nested = self.connection.begin_nested()
+        self.app_session = db.session
+        db.session = db.create_scoped_session({'bind': self.connection, 'binds': {}})
+
+        @event.listens_for(db.session, 'after_transaction_end')
+        def restart_savepoint(session, transaction):
+            if not self.nested.is_active:
+                self.nested = self.connection.begin_nested()
 
     def tearDown(self):
         """Executed after reach test"""
-        pass
+        if self.transactional:
+            db.session.remove()
+            db.session = self.app_session
+            self.transaction.rollback()
+            self.connection.close()
+            # Rolled back writes still bumped the data versions on commit;
+            # bump again so nothing keyed on them outlives the rollback.
+            versions.bump(*versions.TABLES)
+        db.get_engine(self.app).dispose()
+
+
+class TriviaTestCase(TriviaTestBase):
+    """This class represents the trivia test case"""
+
+    def test_ready_reports_pool(self):
+        res = self.client().get('/ready')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertFalse(data['pool']['saturated'])
+
+    def test_ready_503_when_pool_saturated(self):
+        with patch('flaskr.pool_stats', return_value={'saturated': True}):
+            res = self.client().get('/ready')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertFalse(data['success'])
+
+    def test_create_app_without_schema_setup_opens_no_connection(self):
+        with patch('models.setup_schema') as setup_schema:
+            app = create_app({'DATABASE_URL': self.database_path, 'DB_CREATE_SCHEMA': False})
+            res = app.test_client().get('/')
+
+        self.assertEqual(res.status_code, 200)
+        setup_schema.assert_not_called()
+        self.assertEqual(db.get_engine(app).pool.checkedin(), 0)
+
+    def test_init_db_command(self):
+        result = self.app.test_cli_runner().invoke(args=['init-db'])
+
+        self.assertEqual(result.exit_code, 0)
+
+    def stats(self):
+        return json.loads(self.client().get('/stats').data)
+
+    def test_get_stats(self):
+        data = self.stats()
+
+        self.assertTrue(data['success'])
+        self.assertEqual(data['total_questions'], 2)
+        self.assertEqual(data['categories'], {'1': 1, '2': 1})
+        self.assertEqual(data['difficulties'], {'1': 1, '2': 1})
+        self.assertEqual(data['counts'], [{'category': 1, 'difficulty': 1, 'count': 1},
+                                          {'category': 2, 'difficulty': 2, 'count': 1}])
+
+    def test_stats_follow_orm_writes(self):
+        question = Question(question='Counted?', answer='Yes', category=1, difficulty=3)
+        question.insert()
+        question_id = question.id
+        self.assertEqual(self.stats()['difficulties'], {'1': 1, '2': 1, '3': 1})
+
+        question = db.session.get(Question, question_id)
+        question.category, question.difficulty = 2, 2
+        question.update()
+        data = self.stats()
+        self.assertEqual(data['categories'], {'1': 1, '2': 2})
+        self.assertEqual(data['difficulties'], {'1': 1, '2': 2})
+
+        db.session.get(Question, question_id).delete()
+        self.assertEqual(self.stats()['total_questions'], 2)
+
+    def test_stats_follow_import_and_batch_writes(self):
+        rows = [json.dumps({'question': f'Batch {number}?', 'answer': 'Yes',
+                            'category': 2, 'difficulty': 5}) for number in range(3)]
+        self.client().post('/questions/import', data='\n'.join(rows))
+        self.assertEqual(self.stats()['categories'], {'1': 1, '2': 4})
 
-    def seed_data(self):
-        category1 = Category(type='Science')
-        category2 = Category(type='Art')
-        self.db.session.add_all([category1, category2])
-        self.db.session.commit()
+        self.client().patch('/questions', json={'filter': {'difficulty': 5},
+                                                'changes': {'category': 1}})
+        self.assertEqual(self.stats()['categories'], {'1': 4, '2': 1})
 
-        question1 = Question(question='What is H2O?', answer='Water', category=category1.id, difficulty=1)
-        question2 = Question(question='Who painted Mona Lisa?', answer='Da Vinci', category=category2.id, difficulty=2)
-        self.db.session.add_all([question1, question2])
-        self.db.session.commit()
+        self.client().delete('/questions', json={'filter': {'category': 1, 'difficulty': 5}})
+        data = self.stats()
+        self.assertEqual(data['total_questions'], 2)
+        self.assertEqual(data['difficulties'], {'1': 1, '2': 1})
+
+    def test_stats_without_an_upsert(self):
+        # What a dialect other than PostgreSQL and SQLite gets.
+        with patch.dict(stats.UPSERTS, clear=True):
+            res = self.client().post('/questions', json={'question': 'Portable?', 'answer': 'Yes',
+                                                         'category': 2, 'difficulty': 4})
+            self.assertEqual(res.status_code, 201)
+            self.client().patch('/questions', json={'filter': {'difficulty': 4},
+                                                    'changes': {'difficulty': 1}})
+            self.client().delete(f"/questions/{json.loads(res.data)['created']}")
+        data = self.stats()
+
+        self.assertEqual(data['total_questions'], 2)
+        self.assertEqual(data['counts'], [{'category': 1, 'difficulty': 1, 'count': 1},
+                                          {'category': 2, 'difficulty': 2, 'count': 1}])
+
+    def test_list_totals_read_from_counts(self):
+        db.session.execute(QuestionCount.__table__.update().values(count=7))
+        db.session.commit()
+
+        res = self.client().get('/categories/1/questions')
+        self.assertEqual(json.loads(res.data)['total_questions'], 7)
+
+    def test_rebuild_stats_command_repairs_counts(self):
+        db.session.execute(QuestionCount.__table__.update().values(count=7))
+        db.session.commit()
+
+        result = self.app.test_cli_runner().invoke(args=['rebuild-stats'])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('counted 2 questions', result.output)
+        self.assertEqual(self.stats()['total_questions'], 2)
+
+    def test_setup_schema_backfills_empty_counts(self):
+        db.session.execute(QuestionCount.__table__.delete())
+        db.session.commit()
+
+        setup_schema()
+
+        self.assertEqual(self.stats()['total_questions'], 2)
+
+    def test_query_plans_use_indexes(self):
+        results = check_plans(db.session.connection())
+
+        self.assertEqual([result['query'] for result in results if not result['ok']], [])
+
+    def test_metrics_exposes_route_histograms(self):
+        client = self.client()
+        client.get('/questions')
+        res = client.get('/metrics')
+        body = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.mimetype.startswith('text/plain'))
+        self.assertIn('trivia_request_duration_seconds_count{route="/questions",method="GET",status="200"} 1', body)
+        self.assertRegex(body, r'trivia_request_sql_statements_sum\{route="/questions"\} [1-9]')
+        self.assertIn('trivia_response_size_bytes_count{route="/questions"} 1', body)
 
     def test_get_categories_success(self):
         res = self.client().get('/categories')
@@ -65,6 +325,20 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertTrue(len(data['categories']))
 
+    def test_get_categories_sees_new_category(self):
+        self.client().get('/categories')
+        with self.app.app_context():
+            category = Category(type='History')
+            self.db.session.add(category)
+            self.db.session.commit()
+            category_id = category.id
+
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['categories'][str(category_id)], 'History')
+
     def test_get_questions_success(self):
         res = self.client().get('/questions')
         data = json.loads(res.data)
@@ -80,6 +354,99 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 404)
         self.assertFalse(data['success'])
 
+    def test_get_questions_with_cursor(self):
+        res = self.client().get('/questions')
+        first_page = json.loads(res.data)
+        first_id = first_page['questions'][0]['id']
+
+        res = self.client().get(f'/questions?cursor={encode_cursor(first_id)}')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(all(q['id'] > first_id for q in data['questions']))
+        self.assertEqual(data['total_questions'], first_page['total_questions'])
+
+    def test_get_questions_bad_cursor_400(self):
+        res = self.client().get('/questions?cursor=not-a-cursor')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_get_questions_not_modified(self):
+        res = self.client().get('/questions')
+        etag = res.headers['ETag']
+
+        res = self.client().get('/questions', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+        res = self.client().get('/questions?page=2', headers={'If-None-Match': etag})
+        self.assertNotEqual(res.status_code, 304)
+
+    def test_get_questions_etag_changes_after_write(self):
+        res = self.client().get('/questions')
+        etag = res.headers['ETag']
+        payload = {'question': 'Fresh?', 'answer': 'Yes', 'category': 1, 'difficulty': 1}
+        self.client().post('/questions', json=payload)
+
+        res = self.client().get('/questions', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_etag_expires_after_data_version_max_age(self):
+        etag = self.client().get('/questions').headers['ETag']
+        later = time.time() + self.app.config['DATA_VERSION_MAX_AGE']
+
+        with patch('time.time', return_value=later):
+            res = self.client().get('/questions', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_freshness_stays_stale_after_a_write_during_build(self):
+        freshness = versions.Freshness('questions', max_age=60)
+        version = freshness.start()
+        versions.bump('questions')
+        freshness.mark(version)
+        self.assertTrue(freshness.stale())
+
+        freshness.mark(freshness.start())
+        self.assertFalse(freshness.stale())
+        with patch('time.monotonic', return_value=time.monotonic() + 61):
+            self.assertTrue(freshness.expired())
+
+    def test_category_cache_expires_after_data_version_max_age(self):
+        self.client().get('/categories')
+        # A write served by another worker: nothing bumps this process's version.
+        db.session.execute(Category.__table__.insert().values(type='Elsewhere'))
+        db.session.commit()
+
+        data = json.loads(self.client().get('/categories').data)
+        self.assertNotIn('Elsewhere', data['categories'].values())
+        later = time.monotonic() + self.app.config['DATA_VERSION_MAX_AGE'] + 1
+        with patch('time.monotonic', return_value=later):
+            data = json.loads(self.client().get('/categories').data)
+        self.assertIn('Elsewhere', data['categories'].values())
+
+    def test_large_response_is_gzipped(self):
+        self.app.config['COMPRESS_MIN_SIZE'] = 0
+        res = self.client().get('/questions', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        data = json.loads(gzip.decompress(res.data))
+        self.assertTrue(data['success'])
+
+        res = self.client().get('/questions', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 304)
+
+    def test_small_response_is_not_compressed(self):
+        res = self.client().get('/', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('Content-Encoding', res.headers)
+
     def test_delete_question_success(self):
         new_question = Question(question='Temp?', answer='Temp', category=1, difficulty=1)
         new_question.insert()
@@ -96,6 +463,84 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 404)
         self.assertFalse(data['success'])
 
+    def test_batch_delete_questions_by_id(self):
+        with self.app.app_context():
+            doomed = Question(question='Doomed?', answer='Yes', category=1, difficulty=1)
+            doomed.insert()
+            doomed_id = doomed.id
+
+        res = self.client().delete('/questions', json={'ids': [doomed_id, 9999, doomed_id]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deleted'], [doomed_id])
+        self.assertEqual(data['not_found'], [9999])
+        with self.app.app_context():
+            self.assertIsNone(Question.query.get(doomed_id))
+
+    def test_batch_delete_questions_by_filter(self):
+        with self.app.app_context():
+            for number in range(3):
+                Question(question=f'Hard {number}?', answer='Yes', category=2, difficulty=5).insert()
+
+        res = self.client().delete('/questions', json={'filter': {'category': 2, 'difficulty': 5}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_deleted'], 3)
+        self.assertIsNone(data['deleted'])
+        res = self.client().get('/categories/2/questions')
+        self.assertTrue(all(q['difficulty'] != 5 for q in json.loads(res.data)['questions']))
+
+    def test_batch_filter_is_not_capped_by_max_batch_ids(self):
+        with self.app.app_context():
+            db.session.execute(Question.__table__.insert(), [
+                {'question': f'Bulk {number}?', 'answer': 'Yes', 'category': 2, 'difficulty': 5}
+                for number in range(12)])
+            stats.adjust({(2, 5): 12})
+            db.session.commit()
+
+        with patch('flaskr.batch.MAX_BATCH_IDS', 5), patch('flaskr.batch.ID_CHUNK_SIZE', 2):
+            res = self.client().patch('/questions', json={'filter': {'difficulty': 5},
+                                                          'changes': {'difficulty': 4}})
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['total_updated'], 12)
+            self.assertIsNone(data['updated'])
+
+            res = self.client().delete('/questions', json={'filter': {'category': 2,
+                                                                      'difficulty': 4}})
+            self.assertEqual(json.loads(res.data)['total_deleted'], 12)
+        self.assertEqual(self.stats()['categories'], {'1': 1, '2': 1})
+
+    def test_batch_delete_requires_selection(self):
+        for body in ({}, {'ids': []}, {'filter': {}}, {'filter': {'answer': 'x'}}, {'ids': ['1']},
+                     [1, 2], 'ids'):
+            res = self.client().delete('/questions', json=body)
+            self.assertEqual(res.status_code, 400, body)
+            res = self.client().patch('/questions', json=body)
+            self.assertEqual(res.status_code, 400, body)
+
+    def test_batch_patch_questions(self):
+        res = self.client().get('/questions')
+        ids = [q['id'] for q in json.loads(res.data)['questions']][:2]
+
+        res = self.client().patch('/questions', json={'ids': ids + [9999],
+                                                      'changes': {'difficulty': 4}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updated'], ids)
+        self.assertEqual(data['not_found'], [9999])
+        res = self.client().get('/questions')
+        updated = [q for q in json.loads(res.data)['questions'] if q['id'] in ids]
+        self.assertTrue(all(q['difficulty'] == 4 for q in updated))
+
+    def test_batch_patch_rejects_bad_changes(self):
+        for changes in (None, {}, {'id': 5}, {'category': 999}, {'question': ''}):
+            res = self.client().patch('/questions', json={'ids': [1], 'changes': changes})
+            self.assertEqual(res.status_code, 400, changes)
+
     def test_create_question_success(self):
         payload = {
             'question': 'New question?',
@@ -116,6 +561,127 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertFalse(data['success'])
 
+    def test_bulk_import_ndjson_reports_bad_rows(self):
+        rows = [
+            json.dumps({'question': 'Bulk one?', 'answer': 'One', 'category': 1, 'difficulty': 1}),
+            '{not json',
+            json.dumps({'question': 'Bulk two?', 'answer': 'Two', 'category': 999, 'difficulty': 1}),
+            json.dumps({'question': 'Bulk three?', 'answer': 'Three', 'category': 2, 'difficulty': 3}),
+        ]
+        res = self.client().post('/questions/import?batch_size=2', data='\n'.join(rows),
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual(data['failed'], 2)
+        self.assertEqual([error['line'] for error in data['errors']], [2, 3])
+
+    def test_bulk_import_rejects_out_of_range_integers(self):
+        rows = [json.dumps({'question': 'Huge?', 'answer': 'Yes', 'category': 1,
+                            'difficulty': 2 ** 31}),
+                json.dumps({'question': 'Tiny?', 'answer': 'Yes', 'category': -2 ** 40,
+                            'difficulty': 1})]
+        res = self.client().post('/questions/import', data='\n'.join(rows))
+        data = json.loads(res.data)
+
+        self.assertEqual(data['inserted'], 0)
+        self.assertEqual([error['error'] for error in data['errors']],
+                         ['difficulty out of range', 'category out of range'])
+
+    def test_bulk_import_rejects_floats_and_booleans(self):
+        rows = [json.dumps({'question': 'Float?', 'answer': 'Yes', 'category': 1,
+                            'difficulty': 1.7}),
+                json.dumps({'question': 'Bool?', 'answer': 'Yes', 'category': True,
+                            'difficulty': 1}),
+                json.dumps({'question': 'Digits?', 'answer': 'Yes', 'category': '1',
+                            'difficulty': ' 2 '})]
+        res = self.client().post('/questions/import', data='\n'.join(rows))
+        data = json.loads(res.data)
+
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual([error['error'] for error in data['errors']],
+                         ['difficulty must be an integer', 'category must be an integer'])
+
+    def test_bulk_import_reports_undecodable_lines(self):
+        good = json.dumps({'question': 'Caf\u00e9?', 'answer': 'Oui', 'category': 1,
+                           'difficulty': 1}, ensure_ascii=False).encode('utf-8')
+        body = good + b'\n' + good.replace(b'Oui', b'Ou\xff') + b'\n' + good[:-3] + b'\xc3'
+        res = self.client().post('/questions/import', data=body)
+        data = json.loads(res.data)
+
+        self.assertEqual(data['received'], 3)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual([error['line'] for error in data['errors']], [2, 3])
+        self.assertEqual(data['errors'][0]['error'], 'invalid utf-8')
+
+    def test_bulk_import_csv_with_bom_and_bad_bytes(self):
+        body = ('\ufeffquestion,answer,category,difficulty\n'
+                'BOM question?,Yes,1,2\n').encode('utf-8') + b'Bad \xff?,Yes,1,2\nLast?,Yes,2,1\n'
+        res = self.client().post('/questions/import?format=csv', data=body)
+        data = json.loads(res.data)
+
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual(data['errors'], [{'line': 3, 'error': 'invalid utf-8'}])
+
+    def test_bulk_import_isolates_rows_the_database_rejects(self):
+        execute = db.session.execute
+
+        def reject_broken(statement, params=None, *args, **kwargs):
+            if isinstance(params, list) and any(row['question'] == 'Broken?' for row in params):
+                raise IntegrityError('INSERT INTO questions', params, Exception('rejected'))
+            return execute(statement, params, *args, **kwargs)
+
+        rows = [json.dumps({'question': 'Broken?' if number in (2, 5) else f'Fine {number}?',
+                            'answer': 'Yes', 'category': 1, 'difficulty': 1})
+                for number in range(7)]
+        with patch.object(db.session, 'execute', side_effect=reject_broken):
+            res = self.client().post('/questions/import', data='\n'.join(rows))
+        data = json.loads(res.data)
+
+        self.assertEqual(data['inserted'], 5)
+        self.assertEqual([error['line'] for error in data['errors']], [3, 6])
+        self.assertEqual(self.stats()['total_questions'], 7)
+
+    def test_bulk_import_csv(self):
+        body = 'question,answer,category,difficulty\nCSV question?,"Yes, CSV",1,2\n'
+        res = self.client().post('/questions/import', data=body, content_type='text/csv')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(Question.query.filter(Question.answer == 'Yes, CSV').count(), 1)
+
+    def test_bulk_import_400(self):
+        res = self.client().post('/questions/import?format=xml', data='')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_export_questions_ndjson(self):
+        res = self.client().get('/export/questions')
+        lines = res.get_data(as_text=True).splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(lines), Question.query.count())
+        self.assertEqual(set(json.loads(lines[0])), {'id', 'question', 'answer', 'category', 'difficulty'})
+
+    def test_export_categories_csv(self):
+        res = self.client().get('/export/categories?format=csv')
+        lines = res.get_data(as_text=True).splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(lines[0], 'id,type')
+        self.assertEqual(len(lines) - 1, Category.query.count())
+
+    def test_export_unknown_resource_404(self):
+        res = self.client().get('/export/answers')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+
     def test_search_questions_success(self):
         res = self.client().post('/questions', json={'searchTerm': 'What'})
         data = json.loads(res.data)
@@ -132,6 +698,93 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertEqual(len(data['questions']), 0)
 
+    def test_search_questions_matches_answer(self):
+        res = self.client().post('/questions', json={'searchTerm': 'vinci'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(any(q['answer'] == 'Da Vinci' for q in data['questions']))
+
+    def test_search_questions_paginated(self):
+        res = self.client().post('/questions', json={'searchTerm': 'What', 'page': 100})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), 0)
+        self.assertTrue(data['total_questions'])
+
+    def test_suggest_completes_last_word(self):
+        res = self.client().get('/questions/suggest?q=what%20is%20wa')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['prefix'], 'wa')
+        self.assertEqual(data['suggestions'], ['water'])
+
+    def test_suggest_follows_inserts_and_deletes(self):
+        suggest_index = self.app.extensions['suggest']
+        self.client().get('/questions/suggest?q=zeb')
+        question = Question(question='Zebra stripes?', answer='Black', category=1, difficulty=1)
+        question.insert()
+        # Applied on commit, without waiting for a rebuild.
+        self.assertEqual(suggest_index.version, versions.current('questions'))
+
+        res = self.client().get('/questions/suggest?q=zeb')
+        self.assertEqual(json.loads(res.data)['suggestions'], ['zebra'])
+
+        question.delete()
+        res = self.client().get('/questions/suggest?q=zeb')
+        self.assertEqual(json.loads(res.data)['suggestions'], [])
+
+    def test_suggest_rebuilds_after_max_age(self):
+        self.client().get('/questions/suggest?q=zeppel')
+        db.session.execute(Question.__table__.insert().values(
+            question='Which zeppelin?', answer='Graf', category=1, difficulty=1))
+        db.session.commit()
+
+        data = json.loads(self.client().get('/questions/suggest?q=zeppel').data)
+        self.assertEqual(data['suggestions'], [])
+        later = time.monotonic() + self.app.config['SUGGEST_MAX_AGE'] + 1
+        with patch('time.monotonic', return_value=later):
+            data = json.loads(self.client().get('/questions/suggest?q=zeppel').data)
+        self.assertEqual(data['suggestions'], ['zeppelin'])
+
+    def test_suggest_400(self):
+        self.assertEqual(self.client().get('/questions/suggest').status_code, 400)
+        self.assertEqual(self.client().get('/questions/suggest?q=wa&limit=0').status_code, 400)
+
+    def test_get_questions_served_from_cache(self):
+        first = self.client().get('/questions?page=1')
+        second = self.client().get('/questions?page=1')
+        stats = self.app.extensions['response_cache'].stats()['/questions']
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(stats, {'hits': 1, 'misses': 1, 'errors': 0})
+
+    def test_cached_search_invalidated_by_insert(self):
+        self.client().post('/questions', json={'searchTerm': 'Cached'})
+        Question(question='Cached yet?', answer='No', category=1, difficulty=1).insert()
+
+        res = self.client().post('/questions', json={'searchTerm': 'Cached'})
+        data = json.loads(res.data)
+
+        self.assertEqual(data['total_questions'], 1)
+        self.assertEqual(self.app.extensions['response_cache'].stats()['search']['hits'], 0)
+
+    def test_response_cache_stats_exported(self):
+        self.client().get('/categories/1/questions')
+        self.client().get('/categories/1/questions')
+        body = self.client().get('/metrics').get_data(as_text=True)
+
+        self.assertIn('trivia_response_cache_requests_total'
+                      '{route="/categories/<int:category_id>/questions",outcome="hits"} 1', body)
+
+    def test_import_does_not_load_redis(self):
+        code = 'import sys, flaskr; sys.exit("redis" in sys.modules)'
+        self.assertEqual(subprocess.run([sys.executable, '-c', code]).returncode, 0)
+
     def test_get_questions_by_category_success(self):
         res = self.client().get('/categories/1/questions')
         data = json.loads(res.data)
@@ -140,6 +793,30 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertEqual(data['current_category'], 'Science')
 
+    def test_get_questions_by_category_paginated(self):
+        for number in range(12):
+            Question(question=f'Science {number}?', answer='Yes', category=1, difficulty=1).insert()
+
+        res = self.client().get('/categories/1/questions')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), 10)
+        self.assertTrue(all(q['category'] == 1 for q in data['questions']))
+        self.assertGreaterEqual(data['total_questions'], 12)
+        self.assertTrue(data['next_cursor'])
+
+        res = self.client().get(f"/categories/1/questions?cursor={data['next_cursor']}")
+        next_page = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(next_page['questions'][0]['id'], data['questions'][-1]['id'])
+
+    def test_get_questions_by_category_page_404(self):
+        res = self.client().get('/categories/1/questions?page=1000')
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+
     def test_get_questions_by_category_404(self):
         res = self.client().get('/categories/999/questions')
         data = json.loads(res.data)
@@ -159,6 +836,183 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertTrue(data['question'])
 
+    def test_play_quiz_excludes_previous_questions(self):
+        question = Question.query.filter(Question.category == 1).first()
+        payload = {
+            'previous_questions': [question.id],
+            'quiz_category': {'id': 1, 'type': 'Science'}
+        }
+        res = self.client().post('/quizzes', json=payload)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        if data['question'] is not None:
+            self.assertNotEqual(data['question']['id'], question.id)
+
+    def test_play_quiz_session_never_repeats(self):
+        payload = {
+            'quiz_session': None,
+            'quiz_category': {'id': 0, 'type': 'click'}
+        }
+        seen = []
+        while True:
+            res = self.client().post('/quizzes', json=payload)
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertTrue(data['quiz_session'])
+            if data['question'] is None:
+                break
+            seen.append(data['question']['id'])
+            payload['quiz_session'] = data['quiz_session']
+
+        self.assertTrue(seen)
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(len(seen), Question.query.count())
+
+    def test_play_quiz_batch_returns_distinct_questions(self):
+        with self.app.app_context():
+            for number in range(5):
+                Question(question=f'Batch {number}?', answer='Yes', category=1, difficulty=1).insert()
+            total = Question.query.count()
+        payload = {'previous_questions': [], 'count': total + 5,
+                   'quiz_category': {'id': 0, 'type': 'click'}}
+
+        res = self.client().post('/quizzes', json=payload)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        ids = [question['id'] for question in data['questions']]
+        self.assertEqual(len(ids), total)
+        self.assertEqual(len(set(ids)), total)
+        self.assertEqual(data['question'], data['questions'][0])
+
+    def test_random_pick_is_uniform_on_sparse_category(self):
+        # Category 1 gets ids 1, 3-12 and one far-off id, with category 2
+        # filling the gap: the old seek picked the far-off id almost always.
+        with self.app.app_context():
+            db.session.add_all(Question(question=f'Near {number}?', answer='Yes', category=1,
+                                        difficulty=1) for number in range(10))
+            db.session.add_all(Question(question=f'Filler {number}?', answer='Yes', category=2,
+                                        difficulty=1) for number in range(200))
+            db.session.add(Question(question='Far?', answer='Yes', category=1, difficulty=1))
+            db.session.commit()
+            ids = [question.id for question in Question.query.filter(Question.category == 1)]
+            far = max(ids)
+
+            draws = Counter(question['id'] for _ in range(1200)
+                            for question in pick_random_questions(1))
+            remaining = Counter(question['id'] for _ in range(1100)
+                                for question in pick_random_questions(1, exclude={far}))
+
+        # 100 expected per id; a binomial draw lands outside 50-150 about
+        # once in a million runs.
+        self.assertEqual(set(draws), set(ids))
+        for question_id in ids:
+            self.assertTrue(50 <= draws[question_id] <= 150, draws)
+        self.assertNotIn(far, remaining)
+        for question_id in set(ids) - {far}:
+            self.assertTrue(50 <= remaining[question_id] <= 150, remaining)
+
+    def test_rank_fallback_is_uniform_and_skips_played(self):
+        # Probes that always miss force every pick onto the seek by rank:
+        # drawn over the whole category while most of it is free, and over
+        # the free questions once most of it has been played.
+        with self.app.app_context():
+            db.session.add_all(Question(question=f'Ranked {number}?', answer='Yes', category=3,
+                                        difficulty=1) for number in range(12))
+            db.session.commit()
+            ids = [question.id for question in Question.query.filter(Question.category == 3)]
+            played = set(ids[:4])
+            with patch.object(quiz, 'draw_pivots', return_value=[0]):
+                few = Counter(question['id'] for _ in range(800)
+                              for question in pick_random_questions(3, exclude=played))
+                most = Counter(question['id'] for _ in range(300)
+                               for question in pick_random_questions(3, exclude=set(ids[:-3])))
+                batch = pick_random_questions(3, exclude=played, count=20)
+
+        # 100 expected per id; a binomial draw lands outside 50-150 about
+        # once in a million runs.
+        self.assertEqual(set(few), set(ids) - played)
+        for question_id in set(ids) - played:
+            self.assertTrue(50 <= few[question_id] <= 150, few)
+        self.assertEqual(set(most), set(ids[-3:]))
+        for question_id in ids[-3:]:
+            self.assertTrue(50 <= most[question_id] <= 150, most)
+        self.assertEqual(sorted(question['id'] for question in batch), sorted(set(ids) - played))
+
+    def test_probe_count_grows_for_sparse_categories(self):
+        dense = quiz.probe_count(1, 1, 1000, 1000)
+        sparse = quiz.probe_count(1, 1, 200000, 4000)
+
+        self.assertEqual(dense, quiz.PROBES_PER_QUESTION)
+        self.assertGreater(sparse, 200)
+        self.assertEqual(quiz.probe_count(50, 1, 200000, 10), quiz.MAX_PROBES)
+        self.assertEqual(quiz.probe_count(1, 5, 5, 0), quiz.PROBES_PER_QUESTION)
+
+    def test_play_quiz_session_batch(self):
+        payload = {'quiz_session': None, 'count': 2,
+                   'quiz_category': {'id': 0, 'type': 'click'}}
+        seen = []
+        while True:
+            data = json.loads(self.client().post('/quizzes', json=payload).data)
+            self.assertLessEqual(len(data['questions']), 2)
+            if not data['questions']:
+                break
+            seen.extend(question['id'] for question in data['questions'])
+            payload['quiz_session'] = data['quiz_session']
+
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(len(seen), Question.query.count())
+
+    def test_quiz_session_keeps_only_played_ids(self):
+        with self.app.app_context():
+            for number in range(20):
+                Question(question=f'Kept {number}?', answer='Yes', category=1, difficulty=1).insert()
+        payload = {'quiz_session': None, 'count': 3, 'previous_questions': [1],
+                   'quiz_category': {'id': 1, 'type': 'Science'}}
+        data = json.loads(self.client().post('/quizzes', json=payload).data)
+        payload['quiz_session'] = data['quiz_session']
+        played = [question['id'] for question in data['questions']]
+        data = json.loads(self.client().post('/quizzes', json=payload).data)
+        played += [question['id'] for question in data['questions']]
+
+        session = self.app.extensions['quiz_sessions'].get(payload['quiz_session'])
+        self.assertEqual(len(set(played)), 6)
+        self.assertNotIn(1, played)
+        self.assertEqual(session.seen, {1, *played})
+
+    def test_play_quiz_bad_count_400(self):
+        for count in (0, -1, 'two', True, 1000):
+            res = self.client().post('/quizzes', json={
+                'count': count, 'quiz_category': {'id': 0, 'type': 'click'}})
+            self.assertEqual(res.status_code, 400, count)
+
+    def test_play_quiz_unknown_session_404(self):
+        payload = {
+            'quiz_session': 'does-not-exist',
+            'quiz_category': {'id': 0, 'type': 'click'}
+        }
+        res = self.client().post('/quizzes', json=payload)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+
+    def test_play_quiz_session_resumes_on_another_worker(self):
+        payload = {'quiz_session': None, 'quiz_category': {'id': 0, 'type': 'click'}}
+        first = json.loads(self.client().post('/quizzes', json=payload).data)
+
+        other = create_app({'DATABASE_URL': self.database_path, 'DB_CREATE_SCHEMA': False})
+        payload.update(quiz_session=first['quiz_session'],
+                       previous_questions=[first['question']['id']])
+        res = other.test_client().post('/quizzes', json=payload)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['quiz_session'], first['quiz_session'])
+        self.assertNotEqual(data['question']['id'], first['question']['id'])
+        db.get_engine(other).dispose()
+
     def test_play_quiz_400(self):
         res = self.client().post('/quizzes', json={})
         data = json.loads(res.data)
@@ -166,6 +1020,538 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertFalse(data['success'])
 
+    def test_sparse_fields_narrow_reply_and_query(self):
+        statements = []
+        engine = db.get_engine(self.app)
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            res = self.client().get('/questions?fields=question')
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['questions'])
+        for question in data['questions']:
+            self.assertEqual(set(question), {'id', 'question'})
+        selects = [sql for sql in statements if 'FROM questions' in sql]
+        self.assertTrue(selects)
+        self.assertFalse([sql for sql in selects if 'questions.answer' in sql])
+
+    def test_sparse_fields_on_category_search_and_quiz(self):
+        data = json.loads(self.client().get('/categories/1/questions?fields=category').data)
+        self.assertEqual(set(data['questions'][0]), {'id', 'category'})
+
+        data = json.loads(self.client().post('/questions?fields=answer,question',
+                                             json={'searchTerm': 'What'}).data)
+        self.assertEqual(set(data['questions'][0]), {'id', 'question', 'answer'})
+
+        quiz = {'count': 2, 'quiz_category': {'id': 0}}
+        data = json.loads(self.client().post('/quizzes?fields=question', json=quiz).data)
+        self.assertEqual(set(data['question']), {'id', 'question'})
+
+        data = json.loads(self.client().post('/quizzes?fields=question',
+                                             json={**quiz, 'quiz_session': None}).data)
+        self.assertEqual([set(q) for q in data['questions']], [{'id', 'question'}] * 2)
+
+    def test_export_fields(self):
+        res = self.client().get('/export/questions?format=csv&fields=difficulty')
+        self.assertEqual(res.get_data(as_text=True).splitlines()[0], 'id,difficulty')
+        self.assertEqual(self.client().get('/export/categories?fields=answer').status_code, 400)
+
+    def test_unknown_fields_400(self):
+        for path in ('/questions?fields=secret', '/questions?fields=', '/questions?fields=,',
+                     '/categories/1/questions?fields=question,secret'):
+            res = self.client().get(path)
+            self.assertEqual(res.status_code, 400, path)
+            self.assertFalse(json.loads(res.data)['success'])
+        res = self.client().post('/quizzes?fields=secret', json={'quiz_category': {'id': 0}})
+        self.assertEqual(res.status_code, 400)
+        res = self.client().post('/questions?fields=secret', json={'searchTerm': 'What'})
+        self.assertEqual(res.status_code, 400)
+
+
+class QuestionStoreTestCase(TriviaTestBase):
+    """Serves lists and quizzes from the in-memory question store"""
+
+    app_config = {'QUESTION_STORE': True, 'QUESTION_STORE_PRELOAD': False}
+
+    def store(self):
+        return self.app.extensions['question_store']
+
+    def test_pages_match_database(self):
+        for number in range(12):
+            Question(question=f'Paged {number}?', answer='Yes', category=1, difficulty=1).insert()
+        database_app = create_app({'DATABASE_URL': self.database_path, 'DB_CREATE_SCHEMA': False})
+
+        for path in ('/questions', '/questions?page=2', '/categories/1/questions?page=2',
+                     f'/questions?cursor={encode_cursor(3)}', '/categories/2/questions'):
+            expected = json.loads(database_app.test_client().get(path).data)
+            self.assertEqual(json.loads(self.client().get(path).data), expected, path)
+        self.assertEqual(self.client().get('/questions?page=5').status_code, 404)
+        self.assertEqual(self.client().get('/questions?cursor=bad').status_code, 400)
+
+    def test_reloads_after_write(self):
+        self.client().get('/questions')
+        Question(question='Fresh?', answer='Yes', category=2, difficulty=3).insert()
+
+        res = self.client().get('/categories/2/questions')
+        data = json.loads(res.data)
+
+        self.assertEqual(data['total_questions'], 2)
+        self.assertIn('Fresh?', [q['question'] for q in data['questions']])
+        self.assertEqual(self.store().loads, 2)
+
+    def test_stale_snapshot_is_not_cached_or_tagged(self):
+        self.client().get('/questions')
+        Question(question='Rebuilding?', answer='Yes', category=2, difficulty=3).insert()
+
+        # Another request is rebuilding: this one is served the old snapshot.
+        with self.store()._lock:
+            stale = self.client().get('/questions')
+        self.assertEqual(json.loads(stale.data)['total_questions'], 2)
+        self.assertIsNone(stale.headers.get('ETag'))
+
+        fresh = self.client().get('/questions')
+        self.assertEqual(json.loads(fresh.data)['total_questions'], 3)
+        self.assertIsNotNone(fresh.headers.get('ETag'))
+        self.assertEqual(self.app.extensions['response_cache'].stats()['/questions']['hits'], 0)
+
+    def test_quiz_served_from_store(self):
+        ids = [q['id'] for q in json.loads(self.client().get('/questions').data)['questions']]
+
+        res = self.client().post('/quizzes', json={'previous_questions': ids[:1],
+                                                   'quiz_category': {'id': 0}})
+        self.assertEqual(json.loads(res.data)['question']['id'], ids[1])
+
+        res = self.client().post('/quizzes', json={'quiz_session': None, 'count': 5,
+                                                   'quiz_category': {'id': 0}})
+        self.assertEqual(sorted(q['id'] for q in json.loads(res.data)['questions']), ids)
+        self.assertEqual(self.store().loads, 1)
+
+    def test_sparse_fields_match_database(self):
+        database_app = create_app({'DATABASE_URL': self.database_path, 'DB_CREATE_SCHEMA': False})
+        for path in ('/questions?fields=question', '/categories/1/questions?fields=answer,difficulty'):
+            expected = json.loads(database_app.test_client().get(path).data)
+            self.assertEqual(json.loads(self.client().get(path).data), expected, path)
+
+        res = self.client().post('/quizzes?fields=category', json={'quiz_session': None, 'count': 2,
+                                                                  'quiz_category': {'id': 0}})
+        self.assertEqual([set(q) for q in json.loads(res.data)['questions']],
+                         [{'id', 'category'}] * 2)
+        self.assertEqual(self.client().get('/questions?fields=secret').status_code, 400)
+
+    def test_preloaded_store_reports_memory(self):
+        app = create_app({'DATABASE_URL': self.database_path, 'DB_CREATE_SCHEMA': False,
+                          'QUESTION_STORE': True})
+        body = app.test_client().get('/metrics').get_data(as_text=True)
+
+        self.assertEqual(app.extensions['question_store'].loads, 1)
+        self.assertIn('trivia_question_store_questions 2', body)
+
+
+@unittest.skipIf(flask_migrate is None, 'Flask-Migrate is not installed')
+class MigrationsTestCase(unittest.TestCase):
+    """Runs the Alembic revisions against a scratch SQLite file"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.database_path = f"sqlite:///{os.path.join(self.tmpdir, 'trivia.db')}"
+
+    def tearDown(self):
+        db.get_engine(self.app).dispose()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def build(self, create_schema=False):
+        self.app = create_app({'DATABASE_URL': self.database_path,
+                               'DB_CREATE_SCHEMA': create_schema})
+        return self.app
+
+    def schema_diff(self):
+        with db.engine.connect() as connection:
+            return compare_metadata(MigrationContext.configure(connection), db.metadata)
+
+    def test_upgrade_matches_models(self):
+        with self.build().app_context():
+            flask_migrate.upgrade()
+            self.assertEqual(self.schema_diff(), [])
+
+            flask_migrate.downgrade(revision='base')
+            self.assertEqual(db.inspect(db.engine).get_table_names(), ['alembic_version'])
+
+    def test_upgrade_adopts_database_built_before_migrations(self):
+        with sqlite3.connect(os.path.join(self.tmpdir, 'trivia.db')) as connection:
+            connection.executescript("""
+                CREATE TABLE categories (id INTEGER NOT NULL PRIMARY KEY, type VARCHAR NOT NULL);
+                CREATE TABLE questions (id INTEGER NOT NULL PRIMARY KEY, question VARCHAR NOT NULL,
+                    answer VARCHAR NOT NULL, category INTEGER NOT NULL, difficulty INTEGER NOT NULL);
+                CREATE INDEX ix_questions_category_id ON questions (category, id);
+                INSERT INTO categories VALUES (1, 'Science');
+                INSERT INTO questions VALUES (1, 'What is H2O?', 'Water', 1, 1);
+                INSERT INTO questions VALUES (2, 'What is NaCl?', 'Salt', 1, 2);
+            """)
+
+        with self.build().app_context():
+            flask_migrate.upgrade()
+
+            self.assertEqual(self.schema_diff(), [])
+            self.assertEqual(db.session.query(db.func.sum(QuestionCount.count)).scalar(), 2)
+            self.assertEqual(db.session.query(Question).count(), 2)
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    """Routes reads between two SQLite files standing in for a primary and a replica"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        primary = os.path.join(self.tmpdir, 'primary.db')
+        replica = os.path.join(self.tmpdir, 'replica.db')
+        sqlite3.connect(replica).close()
+
+        def build(lag_window):
+            return create_app({
+                'DATABASE_URL': f'sqlite:///{primary}',
+                'DATABASE_REPLICA_URLS': [f'sqlite:///{replica}'],
+                'DB_REPLICA_LAG_WINDOW': lag_window,
+            })
+
+        self.app = build(0)
+        with self.app.app_context():
+            db.session.add(Category(type='Science'))
+            db.session.commit()
+            Question(question='On both?', answer='Yes', category=1, difficulty=1).insert()
+            db.session.remove()
+            db.get_engine().dispose()
+        shutil.copyfile(primary, replica)
+        with sqlite3.connect(replica) as connection:
+            connection.execute("INSERT INTO questions (question, answer, category, difficulty) "
+                               "VALUES ('Replica only?', 'Yes', 1, 1)")
+            connection.execute("UPDATE question_counts SET count = count + 1 "
+                               "WHERE category = 1 AND difficulty = 1")
+        self.build = build
+
+    def tearDown(self):
+        self.app.extensions['replicas'].dispose()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_reads_go_to_replica(self):
+        res = self.app.test_client().get('/questions')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 2)
+
+    def test_writes_go_to_primary_and_pin_reads(self):
+        self.app = self.build(60)
+        client = self.app.test_client()
+        payload = {'question': 'Primary only?', 'answer': 'Yes', 'category': 1, 'difficulty': 1}
+        res = client.post('/questions', json=payload)
+        self.assertEqual(res.status_code, 201)
+        self.assertIn('trivia_last_write', res.headers.get('Set-Cookie', ''))
+
+        res = client.get('/questions')
+        data = json.loads(res.data)
+        self.assertEqual(data['total_questions'], 2)
+        self.assertIn('Primary only?', [q['question'] for q in data['questions']])
+
+
+@unittest.skipIf(TcpFakeServer is None, 'fakeredis is not installed')
+class RedisTestBase(TriviaTestBase):
+    """Runs two app instances against a local Redis-protocol stand-in.
+
+    ``worker_config(url)`` is passed on to ``create_app`` for each of them.
+    """
+
+    def worker_config(self, url):
+        return {}
+
+    def setUp(self):
+        self.server = TcpFakeServer(('127.0.0.1', 0), server_type='redis')
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05},
+                         daemon=True).start()
+        super().setUp()
+        self.url = 'redis://%s:%d/0' % self.server.server_address
+        self.workers = [create_app({'DATABASE_URL': self.database_path,
+                                    'DB_CREATE_SCHEMA': False,
+                                    **self.worker_config(self.url)}) for _ in range(2)]
+
+    def tearDown(self):
+        for worker in self.workers:
+            db.get_engine(worker).dispose()
+        super().tearDown()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class RedisResponseCacheTestCase(RedisTestBase):
+    """Shares the response cache through a local Redis-protocol stand-in"""
+
+    def worker_config(self, url):
+        return {'RESPONSE_CACHE_URL': url}
+
+    def test_entries_shared_between_workers(self):
+        first = self.workers[0].test_client().get('/questions')
+        second = self.workers[1].test_client().get('/questions')
+
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(self.workers[1].extensions['response_cache'].stats()['/questions']['hits'], 1)
+
+    def test_unreachable_server_falls_back_to_the_view(self):
+        app = create_app({'DATABASE_URL': self.database_path, 'DB_CREATE_SCHEMA': False,
+                          'RESPONSE_CACHE_URL': 'redis://127.0.0.1:1/0'})
+        res = app.test_client().get('/questions')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(app.extensions['response_cache'].stats()['/questions']['errors'], 1)
+
+    def test_etags_follow_shared_versions(self):
+        etag = self.workers[0].test_client().get('/questions').headers['ETag']
+        res = self.workers[1].test_client().get('/questions', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+        self.workers[1].extensions['response_cache'].backend.bump(('questions',))
+        res = self.workers[0].test_client().get('/questions', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+
+    def test_no_etag_for_replica_read_right_after_a_bump(self):
+        app = create_app({'DATABASE_URL': self.database_path, 'DB_CREATE_SCHEMA': False,
+                          'RESPONSE_CACHE_URL': self.url,
+                          'DATABASE_REPLICA_URLS': [self.database_path],
+                          'DB_REPLICA_LAG_WINDOW': 60})
+        # This worker has not written lately, so its reads go to the replica.
+        quiet = patch.object(versions, 'seconds_since_bump', return_value=float('inf'))
+        try:
+            with quiet:
+                # A write on another worker: the replica may not have replayed it.
+                self.workers[1].extensions['response_cache'].backend.bump(('questions',))
+                res = app.test_client().get('/questions')
+                self.assertEqual(res.status_code, 200)
+                self.assertIsNone(res.headers.get('ETag'))
+
+                with patch('time.time', return_value=time.time() + 61):
+                    res = app.test_client().get('/questions')
+                self.assertTrue(res.headers['ETag'].startswith('"shared-'))
+        finally:
+            app.extensions['replicas'].dispose()
+
+    def test_write_elsewhere_invalidates_worker(self):
+        self.workers[0].test_client().get('/questions')
+        # What a write in another process does: bump the shared tag only.
+        self.workers[1].extensions['response_cache'].backend.bump(('questions',))
+
+        res = self.workers[0].test_client().get('/questions')
+        stats = self.workers[0].extensions['response_cache'].stats()['/questions']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(stats['hits'], 0)
+
+
+class RedisQuizSessionTestCase(RedisTestBase):
+    """Shares quiz sessions between workers through Redis"""
+
+    def worker_config(self, url):
+        return {'QUIZ_SESSION_URL': url}
+
+    def test_session_continues_on_another_worker(self):
+        with self.app.app_context():
+            for number in range(6):
+                Question(question=f'Shared {number}?', answer='Yes', category=1,
+                         difficulty=1).insert()
+        payload = {'quiz_session': None, 'count': 2, 'quiz_category': {'id': 1}}
+        played = []
+        for round_number in range(4):
+            worker = self.workers[round_number % 2]
+            res = worker.test_client().post('/quizzes', json=payload)
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            played += [question['id'] for question in data['questions']]
+            payload['quiz_session'] = data['quiz_session']
+
+        # Category 1 holds 7 questions: three full rounds, then the last one.
+        self.assertEqual(len(played), 7)
+        self.assertEqual(len(set(played)), 7)
+        session = self.workers[0].extensions['quiz_sessions'].get(payload['quiz_session'])
+        self.assertEqual((session.category_id, session.seen), (1, set(played)))
+
+
+@unittest.skipIf(aiosqlite is None and asyncpg is None, 'no async database driver installed')
+class TriviaAsgiTestCase(TriviaTestBase):
+    """Runs the async entry point against the same database"""
+
+    # The async engine has its own connections, so the sync side must not
+    # hold an open transaction; these tests clean up after themselves.
+    transactional = False
+
+    def setUp(self):
+        super().setUp()
+        self.asgi = create_asgi_app(self.database_path)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.asgi.engine.dispose())
+        self.loop.close()
+        super().tearDown()
+
+    def send(self, method, path, body=None, headers=()):
+        """Run one request and return the ASGI messages the app sent."""
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': query.encode(),
+            'headers': [(b'content-type', b'application/json')] + list(headers),
+        }
+        messages = [{'type': 'http.request',
+                     'body': json.dumps(body).encode() if body is not None else b''}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        self.loop.run_until_complete(self.asgi(scope, receive, send))
+        return sent
+
+    def request(self, method, path, body=None):
+        sent = self.send(method, path, body)
+        return sent[0]['status'], json.loads(sent[1]['body'])
+
+    def test_get_categories_success(self):
+        status, data = self.request('GET', '/categories')
+        self.assertEqual(status, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(len(data['categories']))
+
+    def test_categories_expire_after_data_version_max_age(self):
+        self.request('GET', '/categories')
+        with self.app.app_context():
+            # What another process does: write without bumping this one's versions.
+            db.session.execute(Category.__table__.insert().values(id=50, type='Elsewhere'))
+            db.session.commit()
+        try:
+            status, data = self.request('GET', '/categories/50/questions')
+            self.assertEqual(status, 404)
+
+            later = time.monotonic() + versions.DATA_VERSION_MAX_AGE + 1
+            with patch('time.monotonic', return_value=later):
+                status, data = self.request('GET', '/categories')
+            self.assertEqual(data['categories']['50'], 'Elsewhere')
+        finally:
+            with self.app.app_context():
+                db.session.execute(Category.__table__.delete().where(Category.id == 50))
+                db.session.commit()
+
+    def test_cors_preflight_matches_sync_app(self):
+        preflight = {'Origin': 'http://localhost:3000', 'Access-Control-Request-Method': 'POST'}
+        for path in ('/quizzes', '/questions', '/questions/5'):
+            start, body = self.send('OPTIONS', path, headers=[
+                (key.lower().encode(), value.encode()) for key, value in preflight.items()])
+            headers = {key.decode(): value.decode() for key, value in start['headers']}
+            expected = self.client().options(path, headers=preflight)
+
+            self.assertEqual(start['status'], 200, path)
+            self.assertEqual(expected.status_code, 200, path)
+            self.assertEqual(headers['access-control-allow-origin'],
+                             expected.headers['Access-Control-Allow-Origin'])
+            self.assertIn('POST' if path != '/questions/5' else 'DELETE',
+                          headers['access-control-allow-methods'])
+            self.assertEqual(body['body'], b'')
+
+        status, _ = self.request('OPTIONS', '/nowhere')
+        self.assertEqual(status, 404)
+
+    def test_get_questions_matches_sync_app(self):
+        status, data = self.request('GET', '/questions')
+        expected = json.loads(self.client().get('/questions').data)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(data['questions'], expected['questions'])
+        self.assertEqual(data['total_questions'], expected['total_questions'])
+
+    def test_create_search_and_delete_question(self):
+        payload = {'question': 'Async question?', 'answer': 'Async', 'category': 1, 'difficulty': 2}
+        status, data = self.request('POST', '/questions', payload)
+        self.assertEqual(status, 201)
+        created = data['created']
+
+        status, data = self.request('POST', '/questions', {'searchTerm': 'async question'})
+        self.assertEqual(status, 200)
+        self.assertIn(created, [q['id'] for q in data['questions']])
+
+        status, data = self.request('DELETE', f'/questions/{created}')
+        self.assertEqual(status, 200)
+        self.assertEqual(data['deleted'], created)
+
+    def test_play_quiz_session(self):
+        status, data = self.request('POST', '/quizzes', {
+            'quiz_session': None,
+            'quiz_category': {'id': 1, 'type': 'Science'}
+        })
+        self.assertEqual(status, 200)
+        self.assertTrue(data['quiz_session'])
+        self.assertEqual(data['question']['category'], 1)
+
+    def test_play_quiz_resumes_unknown_session(self):
+        session_id = 'ab' * 16
+        status, data = self.request('POST', '/quizzes', {
+            'quiz_session': session_id,
+            'previous_questions': [1],
+            'quiz_category': {'id': 0, 'type': 'click'}
+        })
+        self.assertEqual(status, 200)
+        self.assertEqual(data['quiz_session'], session_id)
+        self.assertNotEqual(data['question']['id'], 1)
+
+        status, data = self.request('POST', '/quizzes', {
+            'quiz_session': session_id, 'quiz_category': {'id': 0, 'type': 'click'}})
+        self.assertIsNone(data['question'])
+
+    def test_play_quiz_batch(self):
+        status, data = self.request('POST', '/quizzes', {
+            'previous_questions': [],
+            'count': 2,
+            'quiz_category': {'id': 0, 'type': 'click'}
+        })
+        ids = [question['id'] for question in data['questions']]
+        self.assertEqual(status, 200)
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertTrue(1 <= len(ids) <= 2)
+
+    def test_sparse_fields_match_sync_app(self):
+        status, data = self.request('GET', '/questions?fields=question')
+        expected = json.loads(self.client().get('/questions?fields=question').data)
+        self.assertEqual(status, 200)
+        self.assertEqual(data['questions'], expected['questions'])
+
+        status, data = self.request('POST', '/quizzes?fields=answer', {
+            'quiz_session': None, 'quiz_category': {'id': 0}})
+        self.assertEqual(set(data['question']), {'id', 'answer'})
+
+        status, data = self.request('GET', '/categories/1/questions?fields=secret')
+        self.assertEqual(status, 400)
+
+    def test_get_stats_matches_sync_app(self):
+        status, data = self.request('GET', '/stats')
+
+        self.assertEqual(status, 200)
+        self.assertEqual(data, json.loads(self.client().get('/stats').data))
+
+    def test_errors_use_json_contract(self):
+        status, data = self.request('GET', '/categories/999/questions')
+        self.assertEqual(status, 404)
+        self.assertEqual(data['message'], 'resource not found')
+
+        status, data = self.request('POST', '/quizzes', {})
+        self.assertEqual(status, 400)
+        self.assertFalse(data['success'])
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":